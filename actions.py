@@ -4,21 +4,31 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import os
+
+import requests
 from rasa_core.actions.action import Action
 from rasa_core.events import SlotSet
 from apixu.client import ApixuClient, ApixuException
 
+# set to a local stub, such as the one of loadtest.py, to keep the weather offline
+APIXU_URL = os.environ.get('APIXU_URL')
+
+def current_weather(api_key, loc):
+	if APIXU_URL:
+		return requests.get(APIXU_URL + '/v1/current.json', params={'key': api_key, 'q': loc}).json()
+	client = ApixuClient(api_key)
+	return client.getCurrentWeather(q=loc)
+
 class ActionWeather(Action):
 	def name(self):
 		return 'action_weather'
 
 	def run (self,dispatcher,tracker,domain):
-		from apixu.client import ApixuClient
 		api_key = 'a2a1f7505d534755929211912181705'
-		client = ApixuClient(api_key)
 
 		loc = tracker.get_slot('location')
-		current = client.getCurrentWeather(q=loc)
+		current = current_weather(api_key, loc)
 
 		# the response is a dictionnary
 
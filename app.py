@@ -1,13 +1,16 @@
-from flask import Flask, render_template, flash, redirect, url_for, session, request, logging, jsonify
+from flask import Flask, Response, render_template, flash, redirect, url_for, session, request, logging, jsonify
 from flask_mysqldb import MySQL
 from wtforms import Form, StringField, TextAreaField, PasswordField, validators
 from passlib.hash import sha256_crypt
 from functools import wraps
-import requests
 import json
 import os
+import uuid
 import psycopg2
 
+import metrics
+import rasa_client
+
 #for chatbot
 import random
 
@@ -296,22 +299,82 @@ def delete_article(id):
 
     return redirect(url_for('dashboard'))
 
+# Dialogue engine: the Rasa Core server over HTTP by default, or the agent
+# loaded in this process with CHAT_MODE=inprocess. The mode is chosen once at
+# startup: when the models fail to load every request goes to the server until
+# the next restart, a conversation is never split between the two trackers
+CHAT_MODE = os.environ.get('CHAT_MODE', 'http')
+respond = rasa_client.respond
+respond_many = rasa_client.respond_many
+respond_stream = rasa_client.respond_stream
+if CHAT_MODE == 'inprocess':
+    try:
+        import dialogue
+        dialogue.load()
+        respond = dialogue.respond
+        respond_many = dialogue.respond_many
+        respond_stream = dialogue.respond_stream
+    except Exception as e:
+        app.logger.error('Could not load the dialogue models, using the Rasa Core server: %s', e)
+        CHAT_MODE = 'http'
+
+# Conversation id sent to Rasa, one tracker per user
+def sender_id():
+    if 'username' in session:
+        return session['username']
+    if 'sender_id' not in session:
+        session['sender_id'] = uuid.uuid4().hex
+    return session['sender_id']
+
 # chat get/post methods
 @app.route('/chat',methods=["POST"])
 def chat():
     try:
         user_message = request.values.get("text")
-        response = requests.post('http://localhost:5005/conversations/default/respond', json={"query":user_message})
-        response = response.json()
+        response = respond(sender_id(), user_message)
         response_text = json.dumps(response[0].get("text","Wait, what did you said?"))
         return jsonify({"status":"success","response":response_text})
+    except rasa_client.CircuitOpen:
+        return jsonify({"status":"success","response":rasa_client.BUSY_ANSWER})
     except Exception as e:
         print(e)
         return jsonify({"status":"success","response":"Sorry I am not trained to do that yet..."})
 
+# Server-Sent Events, one event per bot message as soon as it is uttered
+@app.route('/chat/stream')
+def chat_stream():
+    user_message = request.args.get("text")
+    sender = sender_id()
+    def events():
+        try:
+            for message in respond_stream(sender, user_message):
+                yield 'data: {}\n\n'.format(json.dumps(message))
+        except rasa_client.CircuitOpen:
+            yield 'data: {}\n\n'.format(json.dumps({"text":rasa_client.BUSY_ANSWER}))
+        except Exception as e:
+            print(e)
+            yield 'data: {}\n\n'.format(json.dumps({"text":"Sorry I am not trained to do that yet..."}))
+        yield 'event: end\ndata: {}\n\n'
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control':'no-cache','X-Accel-Buffering':'no'})
+
+# bulk replay, takes a JSON array of {"sender": ..., "text": ...}
+@app.route('/chat/batch',methods=["POST"])
+def chat_batch():
+    messages = request.get_json(force=True, silent=True)
+    if not isinstance(messages, list) or not all(isinstance(m, dict) and isinstance(m.get("text"), str) and m["text"] for m in messages):
+        return jsonify({"status":"error","response":"Expected a JSON array of {sender, text}"}), 400
+    default_sender = sender_id()
+    responses = respond_many([(str(m.get("sender") or default_sender), m["text"]) for m in messages])
+    return jsonify({"status":"success","responses":responses})
+
+# chat path metrics
+@app.route('/metrics')
+def metrics_view():
+    return jsonify(metrics.snapshot())
+
 if __name__ == '__main__':
 	# must be changed
-    app.secret_key='secret123'
+    app.secret_key=os.environ.get('SECRET_KEY', 'secret123')
     port = int(os.environ.get("PORT", 5000))
     #app.run(port=8000,debug=True)
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def normalize(text):
+    # case folded, with runs of whitespace collapsed
+    return ' '.join(text.lower().split())
+
+
+class LRUCache(object):
+    # bounded least recently used cache, entries expire after ttl seconds
+    def __init__(self, maxsize=1024, ttl=None, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if name:
+            metrics.register(name, self.stats)
+
+    def get(self, key, default=None):
+        return self.get_any((key,), default)
+
+    def get_any(self, keys, default=None):
+        # value of the first of keys in the cache, counted as a single hit or miss
+        with self._lock:
+            for key in keys:
+                item = self._data.get(key)
+                if item is not None and self.ttl is not None and item[1] < time.time():
+                    del self._data[key]
+                    item = None
+                if item is not None:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished = None
+
+
+class SingleFlight(object):
+    # concurrent calls with the same key share the result of the first one,
+    # the result is still handed out for window seconds once it is ready
+    def __init__(self, window=0, name=None):
+        self.window = window
+        self.leaders = 0
+        self.followers = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        if name:
+            metrics.register(name, self.stats)
+
+    def do(self, key, fn):
+        # returns (result, shared), shared being False for the caller that ran fn
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.done.is_set() and flight.finished + self.window < time.time():
+                flight = None
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+        flight.finished = time.time()
+        flight.done.set()
+        with self._lock:
+            now = time.time()
+            for other in [k for k, f in self._flights.items()
+                          if f.done.is_set() and f.finished + self.window <= now]:
+                del self._flights[other]
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, False
+
+    def stats(self):
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "followers": self.followers}
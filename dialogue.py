@@ -0,0 +1,226 @@
+import json
+import os
+import queue
+import threading
+
+from rasa_core.agent import Agent
+from rasa_core.channels.channel import OutputChannel, UserMessage
+from rasa_core.events import ActionExecuted, BotUttered, Event, SlotSet, UserUttered
+from rasa_core.processor import MessageProcessor
+
+import metrics
+from cache import LRUCache, SingleFlight, normalize
+from interpreter import CachedInterpreter
+from model_watcher import ModelWatcher, load_agent, swap_agent
+
+# In-process dialogue engine, used by app.py when CHAT_MODE=inprocess instead
+# of proxying every message to the Rasa Core server
+NLU_MODEL = os.environ.get('NLU_MODEL', './models/nlu/default/moodnlu')
+DIALOGUE_MODEL = os.environ.get('DIALOGUE_MODEL', './models/dialogue')
+
+# Turns made only of templates (utter_greet, utter_goodbye, ...) depend on
+# nothing but the parsed text and the last tracker states the policies look
+# at, so they are answered from this cache without running NLU nor policies
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 300))
+# max_history of the trained policies
+RESPONSE_CACHE_HISTORY = int(os.environ.get('RESPONSE_CACHE_HISTORY', 3))
+# identical messages on identical tracker states arriving within this many
+# seconds of each other share a single turn
+COALESCE_WINDOW = float(os.environ.get('COALESCE_WINDOW', 1))
+
+agent = None
+watcher = None
+response_cache = LRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, name='response_cache')
+flights = SingleFlight(COALESCE_WINDOW, name='coalesced_turns')
+# the keras policy and the in memory tracker store are not thread safe
+_lock = threading.Lock()
+
+
+def load(nlu_model=NLU_MODEL, dialogue_model=DIALOGUE_MODEL):
+    global agent, watcher
+    interpreter = CachedInterpreter(nlu_model)
+    agent = Agent.load(dialogue_model, interpreter=interpreter)
+    response_cache.clear()
+    watcher = ModelWatcher(dialogue_model, lambda path: load_agent(path, interpreter), _swap,
+                           'dialogue_model_swaps').start()
+    return agent
+
+
+def _swap(new_agent):
+    # turns run with the lock held, the one in progress ends on the old agent
+    global agent
+    with _lock:
+        agent = swap_agent(agent, new_agent)
+        response_cache.clear()
+
+
+class CallbackOutputChannel(OutputChannel):
+    # hands every bot message over as soon as the action utters it
+    def __init__(self, on_message):
+        self.on_message = on_message
+
+    def send_text_message(self, recipient_id, message):
+        self.on_message({"recipient_id": recipient_id, "text": message})
+
+    def send_image_url(self, recipient_id, image_url):
+        self.on_message({"recipient_id": recipient_id, "image": image_url})
+
+
+def _fingerprint(tracker):
+    # the active features of the last states, what the policies look at
+    states = agent.domain.features_for_tracker_history(tracker)[-RESPONSE_CACHE_HISTORY:]
+    return json.dumps([sorted(state.items()) if state else None for state in states])
+
+
+def _deterministic(events):
+    # custom actions such as action_weather have side effects, never cache them
+    for event in events:
+        if not isinstance(event, (UserUttered, ActionExecuted, BotUttered, SlotSet)):
+            return False
+        if isinstance(event, ActionExecuted) and not (
+                event.action_name == 'action_listen' or event.action_name.startswith('utter_')):
+            return False
+    return True
+
+
+def _replayable(events, text):
+    # the entities of a parse point into the text it was made for, such a turn
+    # is only reused for the very same text
+    for parameters in events:
+        if parameters["event"] == "user" and (parameters.get("parse_data") or {}).get("entities"):
+            if parameters["text"] != text:
+                return False
+    return True
+
+
+def _replay(sender_id, tracker, text, events, on_message):
+    # applies the events of an earlier turn to this tracker
+    for parameters in events:
+        if parameters["event"] == "user":
+            parse_data = dict(parameters.get("parse_data") or {}, text=text)
+            parameters = dict(parameters, text=text, parse_data=parse_data)
+        tracker.update(Event.from_parameters(parameters))
+    agent.tracker_store.save(tracker)
+    for parameters in events:
+        if parameters["event"] == "bot":
+            on_message({"recipient_id": sender_id, "text": parameters["text"]})
+
+
+def _turn(sender_id, text, on_message, interpreter=None):
+    # must be called with _lock held, returns the events of the turn when
+    # they can be replayed on other trackers. interpreter replaces the one of
+    # the agent for this turn only
+    tracker = agent.tracker_store.get_or_create_tracker(sender_id)
+    key = (normalize(text), _fingerprint(tracker))
+    cached = response_cache.get(key)
+    if cached is not None and _replayable(cached, text):
+        _replay(sender_id, tracker, text, cached, on_message)
+        return cached
+
+    before = len(tracker.events)
+    if interpreter is None:
+        agent.handle_message(text, output_channel=CallbackOutputChannel(on_message),
+                             sender_id=sender_id)
+    else:
+        processor = MessageProcessor(interpreter, agent.policy_ensemble, agent.domain,
+                                     agent.tracker_store)
+        processor.handle_message(UserMessage(text, CallbackOutputChannel(on_message), sender_id))
+    events = list(agent.tracker_store.retrieve(sender_id).events)[before:]
+    if not _deterministic(events):
+        return None
+    events = [event.as_dict() for event in events]
+    response_cache.put(key, events)
+    return events
+
+
+def _handle(sender_id, text, on_message):
+    with _lock:
+        tracker = agent.tracker_store.get_or_create_tracker(sender_id)
+        key = (normalize(text), _fingerprint(tracker))
+
+    def run():
+        with _lock:
+            return _turn(sender_id, text, on_message)
+
+    events, shared = flights.do(key, run)
+    if not shared:
+        return
+    # another request ran the turn, reuse it unless it had side effects or
+    # this conversation moved on in the meantime
+    with _lock:
+        tracker = agent.tracker_store.get_or_create_tracker(sender_id)
+        if events is not None and _replayable(events, text) and _fingerprint(tracker) == key[1]:
+            _replay(sender_id, tracker, text, events, on_message)
+        else:
+            _turn(sender_id, text, on_message)
+
+
+def respond(sender_id, text):
+    # same format as the /conversations/<id>/respond endpoint of the server
+    messages = []
+    _handle(sender_id, text, messages.append)
+    return messages
+
+
+_done = object()
+
+
+def respond_stream(sender_id, text):
+    # yields the bot messages one by one while the next actions are still running
+    messages = queue.Queue()
+    errors = []
+
+    def run():
+        try:
+            _handle(sender_id, text, messages.put)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            messages.put(_done)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        message = messages.get()
+        if message is _done:
+            break
+        yield message
+    if errors:
+        raise errors[0]
+
+
+class PreparsedInterpreter(object):
+    # serves the parse results computed up front for a batch
+    def __init__(self, interpreter, parsed):
+        self.interpreter = interpreter
+        self.parsed = parsed
+
+    def parse(self, text):
+        if text in self.parsed:
+            return self.parsed[text]
+        return self.interpreter.parse(text)
+
+
+def parse_all(interpreter, texts):
+    # every distinct text of the batch is parsed once, in batches
+    texts = list(set(texts))
+    return dict(zip(texts, interpreter.parse_many(texts)))
+
+
+def respond_many(messages):
+    # messages is a list of (sender_id, text), answered in order. Only the NLU
+    # runs in batches, the policies still predict message by message, and the
+    # lock is taken for every message so that live turns are not held up by
+    # the batch
+    parsed = parse_all(agent.interpreter, [text for _, text in messages])
+    results = []
+    for sender_id, text in messages:
+        answers = []
+        try:
+            with _lock:
+                _turn(sender_id, text, answers.append,
+                      PreparsedInterpreter(agent.interpreter, parsed))
+        except Exception:
+            metrics.inc('chat_batch_errors')
+        results.append(answers)
+    return results
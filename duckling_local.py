@@ -0,0 +1,304 @@
+import datetime
+import os
+import re
+
+from rasa_nlu.extractors import EntityExtractor
+
+import metrics
+from cache import LRUCache
+
+# Numbers, ordinals and times extracted in process, in the entity format of
+# ner_duckling, so that no message waits on a duckling server:
+#
+#   - name: "duckling_local.LocalDucklingExtractor"
+#     dimensions: ["number", "time"]
+#
+# Texts without a digit nor a number or time word are skipped by a single
+# regex search. The matches of a text are cached without their values, the
+# times being resolved against the reference time of every message.
+DUCKLING_CACHE_SIZE = int(os.environ.get('DUCKLING_CACHE_SIZE', 4096))
+
+UNITS = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+         "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen",
+         "eighteen", "nineteen"]
+TENS = ["twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+SCALES = {"hundred": 100, "thousand": 1000, "million": 1000000}
+NUMBERS = dict([(word, i) for i, word in enumerate(UNITS)] +
+               [(word, 20 + 10 * i) for i, word in enumerate(TENS)])
+ORDINALS = {"first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6,
+            "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10, "eleventh": 11, "twelfth": 12}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august",
+          "september", "october", "november", "december"]
+DAYS = {"yesterday": -1, "today": 0, "tonight": 0, "tomorrow": 1}
+UNITS_OF_TIME = {"minute": "minutes", "hour": "hours", "day": "days", "week": "weeks"}
+
+
+def _alternatives(words):
+    return '|'.join(sorted(words, key=len, reverse=True))
+
+
+NUMBER_WORD = _alternatives(list(NUMBERS) + list(SCALES))
+# a superset of the PATTERNS below, checked on EXAMPLES at import
+PREFILTER = re.compile(r'\d|\b(?:{}|{}|{}|{}|{}|now|noon|midnight|next|last|this|'
+                       r'minutes?|hours?|days?|weeks?|months?|years?)\b'.format(
+    NUMBER_WORD, _alternatives(ORDINALS), _alternatives(WEEKDAYS), _alternatives(MONTHS),
+    _alternatives(DAYS)), re.IGNORECASE)
+
+CLOCK = (r'(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<meridiem>am|pm|a\.m\.|p\.m\.)'
+         r'|(?P<hour24>\d{1,2}):(?P<minute24>\d{2})|(?P<named>noon|midnight)')
+DAY = (r'(?P<day>{})|(?:(?P<modifier>next|this|last)\s+)?(?P<weekday>{})'.format(
+    _alternatives(DAYS), _alternatives(WEEKDAYS)))
+DATE = (r'(?P<iso>(?P<y>\d{{4}})-(?P<m>\d{{2}})-(?P<d>\d{{2}}))'
+        r'|(?P<month>{0})\s+(?P<mday>\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(?P<year>\d{{4}}))?'
+        r'|(?P<mday2>\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?(?P<month2>{0})(?:,?\s+(?P<year2>\d{{4}}))?'
+        ).format(_alternatives(MONTHS))
+
+PATTERNS = [
+    ("time", re.compile(r'\b(?:{})(?:\s+at)?\s+(?:{})(?=\W|$)'.format(DAY, CLOCK), re.IGNORECASE)),
+    ("time", re.compile(r'\b(?:at\s+)?(?:{})(?=\W|$)'.format(CLOCK), re.IGNORECASE)),
+    ("time", re.compile(r'\b(?:{})\b'.format(DATE), re.IGNORECASE)),
+    ("time", re.compile(r'\b(?:{})\b'.format(DAY), re.IGNORECASE)),
+    ("time", re.compile(r'\b(?P<now>now)\b', re.IGNORECASE)),
+    ("time", re.compile(r'\b(?P<relative>next|last|this)\s+(?P<period>week|month|year)\b', re.IGNORECASE)),
+    ("time", re.compile(r'\bin\s+(?P<amount>\d+|an?|{})\s+(?P<unit>minute|hour|day|week)s?\b'.format(
+        _alternatives(NUMBERS)), re.IGNORECASE)),
+    ("ordinal", re.compile(r'\b(?:(?P<digits>\d+)(?:st|nd|rd|th)|(?P<word>{}))\b'.format(
+        _alternatives(ORDINALS)), re.IGNORECASE)),
+    ("number", re.compile(r'(?<![\w.])(?P<digits>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)(?![\w.]\w)')),
+    ("number", re.compile(r'\b(?P<words>(?:{0})(?:(?:\s+|-)(?:and\s+)?(?:{0}))*)\b'.format(NUMBER_WORD),
+                          re.IGNORECASE)),
+]
+
+# texts matched by every one of the PATTERNS, in order
+EXAMPLES = [
+    ["tomorrow at 5pm", "this friday 18:30"],
+    ["at 7 a.m.", "noon", "at 14:45"],
+    ["2018-06-01", "june 3rd, 2019", "12th of march"],
+    ["yesterday", "next monday"],
+    ["right now"],
+    ["this week", "next month", "last year"],
+    ["in a week", "in a day", "in 10 minutes", "in three hours"],
+    ["the 2nd", "third"],
+    ["1,250.5", "42"],
+    ["two hundred and five"],
+]
+
+
+def check_prefilter():
+    # a text the PREFILTER rejects never reaches the PATTERNS
+    for (dim, pattern), texts in zip(PATTERNS, EXAMPLES):
+        for text in texts:
+            if not pattern.search(text):
+                raise AssertionError("'{}' is not an example of {}".format(text, pattern.pattern))
+            if not PREFILTER.search(text):
+                raise AssertionError("'{}' is rejected by the prefilter".format(text))
+
+
+check_prefilter()
+cache = LRUCache(DUCKLING_CACHE_SIZE, name='duckling_cache')
+
+
+def words_to_number(words):
+    # "two hundred and five" -> 205
+    total = 0
+    current = 0
+    for word in re.split(r'[\s-]+', words.lower()):
+        if word == "and":
+            continue
+        if word in SCALES:
+            current = max(current, 1) * SCALES[word]
+            if SCALES[word] >= 1000:
+                total += current
+                current = 0
+        else:
+            current += NUMBERS[word]
+    return total + current
+
+
+def _number(text):
+    value = float(text.replace(',', ''))
+    return int(value) if value.is_integer() else value
+
+
+def _clock(groups):
+    if groups.get("named"):
+        return (12 if groups["named"].lower() == "noon" else 0), 0
+    if groups.get("hour24"):
+        hour, minute = int(groups["hour24"]), int(groups["minute24"])
+    else:
+        hour, minute = int(groups["hour"]), int(groups.get("minute") or 0)
+        if hour > 12:
+            return None
+        pm = groups["meridiem"].lower().startswith("p")
+        hour = hour % 12 + (12 if pm else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return hour, minute
+
+
+def _spec(dim, groups):
+    # what a match means, independently of the reference time
+    if dim == "number":
+        if groups.get("words"):
+            return words_to_number(groups["words"])
+        return _number(groups["digits"])
+    if dim == "ordinal":
+        return int(groups["digits"]) if groups.get("digits") else ORDINALS[groups["word"].lower()]
+    spec = {}
+    if groups.get("day"):
+        spec["days"] = DAYS[groups["day"].lower()]
+        if groups["day"].lower() == "tonight":
+            spec.setdefault("clock", (20, 0))
+    if groups.get("weekday"):
+        spec["weekday"] = WEEKDAYS.index(groups["weekday"].lower())
+        spec["modifier"] = (groups.get("modifier") or "").lower()
+    if groups.get("hour") or groups.get("hour24") or groups.get("named"):
+        clock = _clock(groups)
+        if clock is None:
+            return None
+        spec["clock"] = clock
+    if groups.get("iso"):
+        spec["date"] = (int(groups["y"]), int(groups["m"]), int(groups["d"]))
+    month = groups.get("month") or groups.get("month2")
+    if month:
+        year = groups.get("year") or groups.get("year2")
+        spec["date"] = (int(year) if year else None, MONTHS.index(month.lower()) + 1,
+                        int(groups.get("mday") or groups.get("mday2")))
+    if groups.get("now"):
+        spec["now"] = True
+    if groups.get("relative"):
+        spec["relative"] = (groups["relative"].lower(), groups["period"].lower())
+    if groups.get("amount"):
+        amount = groups["amount"].lower()
+        amount = 1 if amount in ("a", "an") else NUMBERS[amount] if amount in NUMBERS else int(amount)
+        spec["delta"] = {UNITS_OF_TIME[groups["unit"].lower()]: amount}
+    return spec
+
+
+def scan(text):
+    # (start, end, dim, spec) of the longest non overlapping matches
+    if not PREFILTER.search(text):
+        metrics.inc('duckling_skipped')
+        return []
+    candidates = []
+    for dim, pattern in PATTERNS:
+        for match in pattern.finditer(text):
+            spec = _spec(dim, {k: v for k, v in match.groupdict().items() if v is not None})
+            if spec is not None:
+                candidates.append((match.start(), match.end(), dim, spec))
+    candidates.sort(key=lambda c: (c[0] - c[1], c[0]))
+    taken = []
+    for candidate in candidates:
+        if all(candidate[1] <= start or candidate[0] >= end for start, end, _, _ in taken):
+            taken.append(candidate)
+    return sorted(taken, key=lambda c: c[0])
+
+
+def resolve(spec, reference):
+    # (datetime, grain) of a time spec
+    today = reference.replace(hour=0, minute=0, second=0, microsecond=0)
+    if spec.get("now"):
+        return reference.replace(microsecond=0), "second"
+    if "delta" in spec:
+        grain = "minute" if "minutes" in spec["delta"] or "hours" in spec["delta"] else "day"
+        moment = reference + datetime.timedelta(**spec["delta"])
+        if grain == "day":
+            return moment.replace(hour=0, minute=0, second=0, microsecond=0), grain
+        return moment.replace(second=0, microsecond=0), grain
+    if "relative" in spec:
+        relative, period = spec["relative"]
+        step = {"next": 1, "last": -1, "this": 0}[relative]
+        if period == "week":
+            return today - datetime.timedelta(days=today.weekday() - 7 * step), "week"
+        if period == "month":
+            month = today.month - 1 + step
+            return today.replace(year=today.year + month // 12, month=month % 12 + 1, day=1), "month"
+        return today.replace(year=today.year + step, month=1, day=1), "year"
+
+    day = today
+    if "days" in spec:
+        day = today + datetime.timedelta(days=spec["days"])
+    elif "weekday" in spec:
+        ahead = (spec["weekday"] - today.weekday()) % 7
+        if spec["modifier"] == "next" and ahead == 0:
+            ahead = 7
+        elif spec["modifier"] == "last":
+            ahead -= 7
+        day = today + datetime.timedelta(days=ahead)
+    elif "date" in spec:
+        year, month, mday = spec["date"]
+        try:
+            day = today.replace(year=year or today.year, month=month, day=mday)
+        except ValueError:
+            return None
+        if year is None and day < today:
+            day = day.replace(year=today.year + 1)
+
+    if "clock" not in spec:
+        return day, "day"
+    moment = day.replace(hour=spec["clock"][0], minute=spec["clock"][1])
+    if len(spec) == 1 and moment < reference:
+        # a bare time of day is the next one to come
+        moment += datetime.timedelta(days=1)
+    return moment, ("hour" if not moment.minute else "minute")
+
+
+def _isoformat(moment):
+    offset = moment.strftime('%z') or '+0000'
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.000') + offset[:3] + ':' + offset[3:]
+
+
+def extract(text, reference=None, dimensions=None):
+    # entities of the text in the format of ner_duckling
+    matches = cache.get(text)
+    if matches is None:
+        matches = scan(text)
+        cache.put(text, matches)
+    if reference is None:
+        reference = datetime.datetime.now(datetime.timezone.utc)
+    entities = []
+    for start, end, dim, spec in matches:
+        if dimensions and dim not in dimensions:
+            continue
+        if dim == "time":
+            resolved = resolve(spec, reference)
+            if resolved is None:
+                continue
+            value = {"value": _isoformat(resolved[0]), "grain": resolved[1], "type": "value"}
+            value["values"] = [dict(value)]
+        else:
+            value = {"value": spec, "type": "value"}
+        entities.append({
+            "start": start,
+            "end": end,
+            "text": text[start:end],
+            "value": value["value"],
+            "confidence": 1.0,
+            "additional_info": value,
+            "entity": dim,
+        })
+    return entities
+
+
+class LocalDucklingExtractor(EntityExtractor):
+    # drop in replacement of ner_duckling for numbers and times
+
+    name = "ner_duckling_local"
+
+    provides = ["entities"]
+
+    defaults = {
+        # by default all dimensions recognized are extracted, else a list of
+        # "number", "ordinal" and "time"
+        "dimensions": None
+    }
+
+    def process(self, message, **kwargs):
+        reference = None
+        if message.time is not None:
+            # milliseconds since the epoch, as for ner_duckling
+            reference = datetime.datetime.fromtimestamp(int(message.time) / 1000.0, datetime.timezone.utc)
+        entities = self.add_extractor_name(
+            extract(message.text, reference, self.component_config["dimensions"]))
+        message.set("entities", message.get("entities", []) + entities, add_to_output=True)
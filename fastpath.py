@@ -0,0 +1,124 @@
+import json
+import os
+import re
+
+import metrics
+from cache import normalize
+
+# Intents whose examples are all short and entity free, like greet and
+# goodbye, are answered from a regex compiled out of the training data
+# without running spaCy and the rest of the pipeline. With the gazetteer of the
+# model, the examples differing only by their location ("What's the weather in
+# Paris") are answered the same way for any city it knows.
+FASTPATH_MAX_TOKENS = int(os.environ.get('FASTPATH_MAX_TOKENS', 3))
+
+
+def closed_class_phrases(examples, max_tokens=FASTPATH_MAX_TOKENS):
+    # phrase -> intent, for the intents that can be matched exactly
+    by_intent = {}
+    for example in examples:
+        by_intent.setdefault(example.get('intent'), []).append(example)
+    phrases = {}
+    ambiguous = set()
+    for intent, items in by_intent.items():
+        if not intent or any(e.get('entities') or len(e['text'].split()) > max_tokens for e in items):
+            continue
+        for example in items:
+            phrase = normalize(example['text']).strip(' !?.,')
+            if phrases.get(phrase, intent) != intent:
+                ambiguous.add(phrase)
+            phrases[phrase] = intent
+    # a phrase also used by an open intent can not be trusted either
+    for example in examples:
+        phrase = normalize(example['text']).strip(' !?.,')
+        if phrases.get(phrase, example.get('intent')) != example.get('intent'):
+            ambiguous.add(phrase)
+    return {phrase: intent for phrase, intent in phrases.items() if phrase not in ambiguous}
+
+
+def template(text, matches):
+    # normalized text with the gazetteer matches replaced by a placeholder
+    for start, end, _ in reversed(matches):
+        text = text[:start] + '<location>' + text[end:]
+    return normalize(text).strip(' !?.,')
+
+
+def informative(key):
+    # a template needs words of its own, a bare location says nothing of the
+    # intent
+    return bool(key.replace('<location>', '').strip(' !?.,'))
+
+
+def location_templates(examples, gazetteer):
+    # template -> intent, for the examples whose entities are exactly the
+    # locations found by the gazetteer
+    templates = {}
+    ambiguous = set()
+    for example in examples:
+        matches = gazetteer.find(example['text'])
+        if not matches:
+            continue
+        key = template(example['text'], matches)
+        if not informative(key):
+            continue
+        entities = example.get('entities') or []
+        spans = sorted((e['start'], e['end']) for e in entities if e['entity'] == gazetteer.entity)
+        exact = len(spans) == len(entities) and spans == [(start, end) for start, end, _ in matches]
+        if not exact or templates.get(key, example.get('intent')) != example.get('intent'):
+            ambiguous.add(key)
+        templates[key] = example.get('intent')
+    return {key: intent for key, intent in templates.items() if key not in ambiguous}
+
+
+class FastPathMatcher(object):
+    def __init__(self, phrases, templates=None, gazetteer=None, name=None):
+        self.intents = sorted(set(phrases.values()))
+        alternatives = []
+        for i, intent in enumerate(self.intents):
+            words = sorted((p for p, name in phrases.items() if name == intent), key=len, reverse=True)
+            alternatives.append('(?P<i{}>{})'.format(i, '|'.join(re.escape(w) for w in words)))
+        self.pattern = re.compile(r'^(?:{})[\s!?.,]*$'.format('|'.join(alternatives))) if alternatives else None
+        self.templates = templates or {}
+        self.gazetteer = gazetteer
+        # the hits and misses are counted in metrics as nlu_fastpath_hits.<name>
+        # and nlu_fastpath_misses.<name>, across the versions of the model
+        self.name = name
+
+    @classmethod
+    def from_training_data(cls, path, gazetteer=None, name=None):
+        if not os.path.exists(path):
+            return cls({}, name=name)
+        with open(path) as f:
+            data = json.load(f)
+        examples = data['rasa_nlu_data'].get('common_examples', [])
+        templates = location_templates(examples, gazetteer) if gazetteer else None
+        return cls(closed_class_phrases(examples), templates, gazetteer, name)
+
+    def _count(self, outcome):
+        if self.name:
+            metrics.inc('nlu_fastpath_{}.{}'.format(outcome, self.name))
+
+    def match(self, text):
+        # parse result with confidence 1.0, or None to run the full pipeline
+        match = self.pattern.match(normalize(text)) if self.pattern else None
+        if match is not None:
+            self._count('hits')
+            intent = {"name": self.intents[int(match.lastgroup[1:])], "confidence": 1.0}
+            return {"text": text, "intent": intent, "entities": [], "intent_ranking": [dict(intent)]}
+        matches = self.gazetteer.find(text) if self.templates else None
+        if matches and any(self.gazetteer.ambiguous(match[2]) for match in matches):
+            # names which are also common words are left to the pipeline
+            matches = None
+        name = self.templates.get(template(text, matches)) if matches else None
+        if name is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        intent = {"name": name, "confidence": 1.0}
+        return {"text": text, "intent": intent, "entities": self.gazetteer.entities(text),
+                "intent_ranking": [dict(intent)]}
+
+    def stats(self):
+        hits = metrics.counter('nlu_fastpath_hits.{}'.format(self.name))
+        total = hits + metrics.counter('nlu_fastpath_misses.{}'.format(self.name))
+        return {"hit_rate": float(hits) / total if total else 0.0}
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import aiohttp
+from aiohttp import web
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature
+
+import metrics
+import rasa_client
+
+# asyncio front for the chat routes of app.py: one process keeps thousands of
+# conversations waiting on Rasa Core instead of one Flask thread each. The
+# other routes are still served by app.py, put both behind the same proxy
+# with /chat* sent here.
+GATEWAY_PORT = int(os.environ.get('GATEWAY_PORT', 5001))
+# in-flight requests toward the Rasa Core servers
+GATEWAY_CONCURRENCY = int(os.environ.get('GATEWAY_CONCURRENCY', 100))
+
+# reads and writes the session cookie of app.py to find the sender id
+_flask = Flask(__name__)
+_flask.secret_key = os.environ.get('SECRET_KEY', 'secret123')
+_serializer = SecureCookieSessionInterface().get_signing_serializer(_flask)
+_cookie_name = _flask.session_cookie_name
+
+
+def sender_id(request):
+    # returns the sender id and, for a new visitor, the session cookie to set
+    session = {}
+    cookie = request.cookies.get(_cookie_name)
+    if cookie:
+        try:
+            session = _serializer.loads(cookie)
+        except BadSignature:
+            session = {}
+    if 'username' in session:
+        return session['username'], None
+    if 'sender_id' in session:
+        return session['sender_id'], None
+    session['sender_id'] = uuid.uuid4().hex
+    return session['sender_id'], _serializer.dumps(dict(session))
+
+
+def set_session(response, cookie):
+    if cookie:
+        response.set_cookie(_cookie_name, cookie, httponly=True)
+    return response
+
+
+async def respond(app, sender_id, text):
+    url, breaker = rasa_client.route(sender_id)
+    timeout = aiohttp.ClientTimeout(
+        total=min(rasa_client.READ_TIMEOUT, rasa_client.LATENCY_BUDGET),
+        sock_connect=rasa_client.CONNECT_TIMEOUT)
+    async with app['rasa_slots']:
+        # the wait for a slot is ours, only the upstream request counts
+        # toward the latency budget
+        start = time.time()
+        try:
+            async with app['client'].post(url, json={"query": text}, timeout=timeout) as response:
+                response.raise_for_status()
+                result = await response.json()
+        except Exception:
+            breaker.failure()
+            raise
+        elapsed = time.time() - start
+    breaker.record(elapsed)
+    return result
+
+
+# chat get/post methods, same answers as app.chat()
+async def chat(request):
+    data = await request.post()
+    sender, cookie = sender_id(request)
+    try:
+        response = await respond(request.app, sender, data.get("text"))
+        response_text = json.dumps(response[0].get("text","Wait, what did you said?"))
+        body = {"status":"success","response":response_text}
+    except rasa_client.CircuitOpen:
+        body = {"status":"success","response":rasa_client.BUSY_ANSWER}
+    except Exception as e:
+        print(e)
+        body = {"status":"success","response":"Sorry I am not trained to do that yet..."}
+    return set_session(web.json_response(body), cookie)
+
+
+# Server-Sent Events, same stream as app.chat_stream()
+async def chat_stream(request):
+    sender, cookie = sender_id(request)
+    stream = set_session(web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}), cookie)
+    await stream.prepare(request)
+    try:
+        for message in await respond(request.app, sender, request.query.get("text")):
+            await stream.write('data: {}\n\n'.format(json.dumps(message)).encode('utf-8'))
+    except rasa_client.CircuitOpen:
+        await stream.write('data: {}\n\n'.format(json.dumps({"text":rasa_client.BUSY_ANSWER})).encode('utf-8'))
+    except Exception as e:
+        print(e)
+        await stream.write('data: {}\n\n'.format(json.dumps({"text":"Sorry I am not trained to do that yet..."})).encode('utf-8'))
+    await stream.write(b'event: end\ndata: {}\n\n')
+    await stream.write_eof()
+    return stream
+
+
+# bulk replay, same input and output as app.chat_batch()
+async def chat_batch(request):
+    try:
+        messages = await request.json()
+    except ValueError:
+        messages = None
+    if not isinstance(messages, list) or not all(isinstance(m, dict) and isinstance(m.get("text"), str) and m["text"] for m in messages):
+        return web.json_response({"status":"error","response":"Expected a JSON array of {sender, text}"}, status=400)
+    default_sender, cookie = sender_id(request)
+    by_sender = OrderedDict()
+    for index, m in enumerate(messages):
+        by_sender.setdefault(str(m.get("sender") or default_sender), []).append((index, m["text"]))
+    results = [[] for _ in messages]
+
+    async def run(sender, items):
+        for index, text in items:
+            try:
+                results[index] = await respond(request.app, sender, text)
+            except Exception:
+                metrics.inc('chat_batch_errors')
+
+    await asyncio.gather(*[run(sender, items) for sender, items in by_sender.items()])
+    return set_session(web.json_response({"status":"success","responses":results}), cookie)
+
+
+async def metrics_view(request):
+    return web.json_response(metrics.snapshot())
+
+
+async def start(app):
+    connector = aiohttp.TCPConnector(limit=GATEWAY_CONCURRENCY)
+    app['client'] = aiohttp.ClientSession(connector=connector)
+    app['rasa_slots'] = asyncio.Semaphore(GATEWAY_CONCURRENCY)
+
+
+async def stop(app):
+    await app['client'].close()
+
+
+def make_app():
+    app = web.Application()
+    app.router.add_post('/chat', chat)
+    app.router.add_get('/chat/stream', chat_stream)
+    app.router.add_post('/chat/batch', chat_batch)
+    app.router.add_get('/metrics', metrics_view)
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(make_app(), port=GATEWAY_PORT)
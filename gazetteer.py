@@ -0,0 +1,170 @@
+import io
+import json
+import os
+
+from rasa_nlu.extractors import EntityExtractor
+
+# Tags the cities and countries of data/locations.txt, and the locations of the
+# training data, without spaCy: the names are compiled into an Aho-Corasick
+# automaton so that a text is scanned once whatever the number of names.
+#
+#   - name: "ner_crf"
+#   - name: "gazetteer.LocationGazetteer"
+#
+# Placed after ner_crf, its matches replace the overlapping locations of the
+# crf, such as "New" tagged alone out of "New York".
+GAZETTEER_FILE = './data/locations.txt'
+GAZETTEER_MODEL_FILE_NAME = "location_gazetteer.json"
+
+
+def read_names(path):
+    # (names, capitalized) with one name per line, # starts a comment and the
+    # names starting with * are only matched when capitalized
+    with io.open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [line.lstrip("*") for line in lines], [line[1:] for line in lines if line.startswith("*")]
+
+
+def _fold(text):
+    # lower case with the offsets of the text kept
+    folded = text.lower()
+    if len(folded) != len(text):
+        folded = "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+    return folded
+
+
+class Gazetteer(object):
+    def __init__(self, names, entity="location", capitalized=()):
+        self.names = sorted(set(names))
+        self.entity = entity
+        # names which are also common words, matched only when the text
+        # starts them with a capital letter inside a sentence
+        self.capitalized = sorted(set(capitalized) & set(self.names))
+        self._capitalized = set(self.capitalized)
+        # goto transitions, failure links and the (length, name) of the names
+        # ending in every state
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for name in self.names:
+            state = 0
+            for c in _fold(name):
+                if c not in self.goto[state]:
+                    self.goto[state][c] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = self.goto[state][c]
+            self.output[state].append((len(name), name))
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for c, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and c not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(c, 0) if state else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+                queue.append(child)
+
+    @classmethod
+    def load(cls, path):
+        with io.open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["names"], data["entity"], data.get("capitalized", ()))
+
+    def save(self, path):
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"entity": self.entity, "names": self.names,
+                                "capitalized": self.capitalized}, ensure_ascii=False))
+
+    def find(self, text):
+        # (start, end, name) of the leftmost longest whole word matches
+        folded = _fold(text)
+        found = []
+        state = 0
+        for i, c in enumerate(folded):
+            while state and c not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(c, 0)
+            for length, name in self.output[state]:
+                start = i + 1 - length
+                if name in self._capitalized and not self._proper(text, start):
+                    continue
+                if (start == 0 or not folded[start - 1].isalnum()) and (
+                        i + 1 == len(folded) or not folded[i + 1].isalnum()):
+                    found.append((start, i + 1, name))
+        found.sort(key=lambda match: (match[0], match[0] - match[1]))
+        matches = []
+        for match in found:
+            if not matches or match[0] >= matches[-1][1]:
+                matches.append(match)
+        return matches
+
+    @staticmethod
+    def _proper(text, start):
+        # capitalized elsewhere than at the start of a sentence, where any
+        # word is ("Nice to meet you")
+        previous = text[:start].rstrip()
+        return text[start].isupper() and bool(previous) and previous[-1] not in ".!?"
+
+    def ambiguous(self, name):
+        # names which are also common words
+        return name in self._capitalized
+
+    def entities(self, text, extractor="ner_gazetteer"):
+        return [{"start": start, "end": end, "value": name, "entity": self.entity,
+                 "confidence": 1.0, "extractor": extractor}
+                for start, end, name in self.find(text)]
+
+
+def merge(entities, found):
+    # a match replaces the entities of the same type it overlaps, unless one of
+    # them spans it entirely
+    def overlap(a, b):
+        return a["entity"] == b["entity"] and a["start"] < b["end"] and b["start"] < a["end"]
+
+    found = [g for g in found if not any(
+        overlap(e, g) and e["start"] <= g["start"] and g["end"] <= e["end"] for e in entities)]
+    return [e for e in entities if not any(overlap(e, g) for g in found)] + found
+
+
+class LocationGazetteer(EntityExtractor):
+    name = "ner_gazetteer"
+
+    provides = ["entities"]
+
+    defaults = {
+        "entity": "location",
+        # names known in advance, added to the values of the training data
+        "gazetteer": GAZETTEER_FILE
+    }
+
+    def __init__(self, component_config=None, gazetteer=None):
+        super(LocationGazetteer, self).__init__(component_config)
+        self.gazetteer = gazetteer
+
+    def train(self, training_data, cfg, **kwargs):
+        entity = self.component_config["entity"]
+        names, capitalized = [], []
+        if os.path.exists(self.component_config["gazetteer"]):
+            names, capitalized = read_names(self.component_config["gazetteer"])
+        for example in training_data.entity_examples:
+            names += [e["value"] for e in example.get("entities", []) if e["entity"] == entity]
+        self.gazetteer = Gazetteer(names, entity, capitalized)
+
+    def process(self, message, **kwargs):
+        if self.gazetteer is None:
+            return
+        found = self.gazetteer.entities(message.text, self.name)
+        message.set("entities", merge(message.get("entities", []), found), add_to_output=True)
+
+    def persist(self, model_dir):
+        if self.gazetteer is not None:
+            self.gazetteer.save(os.path.join(model_dir, GAZETTEER_MODEL_FILE_NAME))
+        return {"gazetteer_file": GAZETTEER_MODEL_FILE_NAME}
+
+    @classmethod
+    def load(cls, model_dir=None, model_metadata=None, cached_component=None, **kwargs):
+        meta = model_metadata.for_component(cls.name)
+        path = os.path.join(model_dir, meta.get("gazetteer_file", GAZETTEER_MODEL_FILE_NAME))
+        return cls(meta, Gazetteer.load(path) if os.path.exists(path) else None)
@@ -0,0 +1,180 @@
+import copy
+import io
+import json
+import os
+import time
+
+from rasa_core.interpreter import RasaNLUInterpreter
+from rasa_nlu.extractors.entity_synonyms import EntitySynonymMapper
+from rasa_nlu.training_data import Message
+
+import metrics
+from cache import LRUCache, normalize
+from fastpath import FastPathMatcher
+from gazetteer import GAZETTEER_MODEL_FILE_NAME, Gazetteer
+from model_watcher import ModelWatcher
+from nlu_batch import parse_many
+from synonyms import SynonymMapper
+
+NLU_CACHE_SIZE = int(os.environ.get('NLU_CACHE_SIZE', 4096))
+# training examples parsed by a new model before it is swapped in
+MODEL_WARMUP = int(os.environ.get('MODEL_WARMUP', 5))
+NLU_FASTPATH = os.environ.get('NLU_FASTPATH', '1') == '1'
+# adds the time spent in each component to the parse results
+NLU_DEBUG_TIMINGS = os.environ.get('NLU_DEBUG_TIMINGS', '0') == '1'
+
+
+def timed(component):
+    # wraps component.process to record its latency
+    process = component.process
+
+    def timed_process(message, **kwargs):
+        start = time.time()
+        try:
+            return process(message, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            metrics.observe('nlu_component_seconds.' + component.name, elapsed)
+            if NLU_DEBUG_TIMINGS:
+                timings = message.get("component_timings") or {}
+                timings[component.name] = elapsed
+                message.set("component_timings", timings, add_to_output=True)
+
+    component.process = timed_process
+    return component
+
+
+def instrument(interpreter):
+    # times every component of a rasa_nlu Interpreter
+    for component in interpreter.pipeline:
+        if not getattr(component, 'timed', False):
+            timed(component)
+            component.timed = True
+    return interpreter
+
+
+def warm(interpreter, model_directory, count=MODEL_WARMUP):
+    # the first parses of a model are the slowest ones
+    path = os.path.join(model_directory, 'training_data.json')
+    if not os.path.exists(path):
+        return interpreter
+    with io.open(path, encoding='utf-8') as f:
+        examples = json.load(f)['rasa_nlu_data'].get('common_examples', [])
+    for example in examples[:count]:
+        interpreter.parse(example['text'])
+    return interpreter
+
+
+def map_synonyms(interpreter, result):
+    # the entities of the fast path did not go through the pipeline, its
+    # synonym mappers still give them their canonical value
+    if not result["entities"]:
+        return result
+    message = Message(result["text"], {"entities": result["entities"]})
+    for component in interpreter.pipeline:
+        if isinstance(component, (EntitySynonymMapper, SynonymMapper)):
+            component.process(message)
+    result["entities"] = message.get("entities")
+    return result
+
+
+class NLUModel(object):
+    # one version of the model, swapped as a whole
+    def __init__(self, interpreter, fastpath, cache):
+        self.interpreter = interpreter
+        self.fastpath = fastpath
+        self.cache = cache
+
+
+def cache_key(text, result=None):
+    # results without entities are shared by the texts differing only by case
+    # and spacing, the others point into their own text
+    if result is not None and result.get("entities"):
+        return True, text
+    return False, normalize(text)
+
+
+class CachedInterpreter(RasaNLUInterpreter):
+    # the NLU pipeline only runs for texts that neither the fast path nor the
+    # cache can answer, a new version of the model directory is loaded in the
+    # background and replaces the current model with an empty cache
+    def __init__(self, model_directory, config_file=None, cache_size=NLU_CACHE_SIZE):
+        self.model_directory = model_directory
+        self.config_file = config_file
+        self.lazy_init = False
+        self.cache_size = cache_size
+        self.model = None
+        # the metrics of every model in the process are kept apart
+        self.metrics_name = os.path.normpath(model_directory)
+        self.swap(self.load_model(model_directory))
+        metrics.register('nlu_fastpath.' + self.metrics_name, lambda: self.model.fastpath.stats())
+        self.watcher = ModelWatcher(model_directory, self.load_model, self.swap,
+                                    'nlu_model_swaps.' + self.metrics_name).start()
+
+    @property
+    def interpreter(self):
+        return self.model.interpreter
+
+    def load_model(self, model_directory):
+        from rasa_nlu.model import Interpreter
+
+        interpreter = warm(Interpreter.load(model_directory), model_directory)
+        return NLUModel(instrument(interpreter), self._load_fastpath(model_directory),
+                        LRUCache(self.cache_size))
+
+    def swap(self, model):
+        # parses hold on to the model they started with
+        self.model = model
+        metrics.register('nlu_cache.' + self.metrics_name, model.cache.stats)
+
+    def _load_fastpath(self, model_directory):
+        if not NLU_FASTPATH:
+            return FastPathMatcher({})
+        gazetteer = os.path.join(model_directory, GAZETTEER_MODEL_FILE_NAME)
+        return FastPathMatcher.from_training_data(
+            os.path.join(model_directory, 'training_data.json'),
+            Gazetteer.load(gazetteer) if os.path.exists(gazetteer) else None, self.metrics_name)
+
+    @staticmethod
+    def _match(model, text):
+        result = model.fastpath.match(text)
+        return map_synonyms(model.interpreter, result) if result is not None else None
+
+    @staticmethod
+    def _cached(model, text):
+        # the result of a similar text without entities, or of this very text
+        return model.cache.get_any((cache_key(text), (True, text)))
+
+    def parse(self, text):
+        model = self.model
+        result = self._match(model, text)
+        if result is not None:
+            return result
+        result = self._cached(model, text)
+        if result is None:
+            result = model.interpreter.parse(text)
+            model.cache.put(cache_key(text, result), result)
+            return copy.deepcopy(result)
+        result = copy.deepcopy(result)
+        result["text"] = text
+        # the components did not run for this text
+        result.pop("component_timings", None)
+        return result
+
+    def parse_many(self, texts, batch_size=64):
+        # the texts missing from the cache are parsed in batches
+        model = self.model
+        parsed = {}
+        for text in texts:
+            if text not in parsed:
+                parsed[text] = self._match(model, text) or self._cached(model, text)
+        missing = [text for text, result in parsed.items() if result is None]
+        for text, result in zip(missing, parse_many(missing, batch_size, model.interpreter)):
+            model.cache.put(cache_key(text, result), result)
+            parsed[text] = result
+        results = []
+        for text in texts:
+            result = copy.deepcopy(parsed[text])
+            result["text"] = text
+            results.append(result)
+        return results
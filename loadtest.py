@@ -0,0 +1,266 @@
+import argparse
+import json
+import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Replays conversations against the /chat route of app.py or the respond
+# endpoint of the Rasa Core server and reports throughput and latencies.
+#
+#   python loadtest.py --target rasa --stub --concurrency 20
+#   python loadtest.py --target chat --url http://localhost:5000 --source messages.jsonl
+#
+# --stub serves both the Rasa respond endpoint and the Apixu current weather
+# endpoint locally, run the Rasa Core server with APIXU_URL pointing at it to
+# keep action_weather offline.
+
+DATA_FILE = './data/data.json'
+STORIES_FILE = './data/stories.md'
+
+
+def load_examples(data_file=DATA_FILE):
+    with open(data_file) as f:
+        return json.load(f)['rasa_nlu_data']['common_examples']
+
+
+def data_conversations(data_file=DATA_FILE):
+    # every example text of the training data is its own conversation
+    return [('data-{}'.format(i), [example['text']])
+            for i, example in enumerate(load_examples(data_file))]
+
+
+def example_text(examples, intent, entities):
+    # text of an example of the intent, with the entity values of the story
+    for example in examples:
+        if example['intent'] != intent:
+            continue
+        found = {e['entity']: e for e in example['entities']}
+        if set(found) != set(entities):
+            continue
+        text = example['text']
+        for entity in sorted(found.values(), key=lambda e: e['start'], reverse=True):
+            text = text[:entity['start']] + entities[entity['entity']] + text[entity['end']:]
+        return text
+    return None
+
+
+def story_conversations(stories_file=STORIES_FILE, data_file=DATA_FILE):
+    # one conversation per story, the user turns being rebuilt from examples
+    examples = load_examples(data_file)
+    conversations = []
+    texts = None
+    with open(stories_file) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('##'):
+                texts = []
+                conversations.append(('story-{}'.format(len(conversations)), texts))
+                continue
+            match = re.match(r'^\*\s*([\w-]+)\s*(\{.*\})?$', line)
+            if match and texts is not None:
+                entities = json.loads(match.group(2)) if match.group(2) else {}
+                text = example_text(examples, match.group(1), entities)
+                if text:
+                    texts.append(text)
+    return [conversation for conversation in conversations if conversation[1]]
+
+
+def jsonl_conversations(path):
+    # one {"sender": ..., "text": ...} per line, a request without sender is
+    # its own conversation
+    conversations = {}
+    order = []
+    with open(path) as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            text = message.get('text') or message.get('body')
+            if not text:
+                continue
+            sender = str(message.get('sender') or 'jsonl-{}'.format(i))
+            if sender not in conversations:
+                conversations[sender] = []
+                order.append(sender)
+            conversations[sender].append(text)
+    return [(sender, conversations[sender]) for sender in order]
+
+
+def load_conversations(sources):
+    conversations = []
+    for source in sources:
+        if source == 'data':
+            conversations += data_conversations()
+        elif source == 'stories':
+            conversations += story_conversations()
+        else:
+            conversations += jsonl_conversations(source)
+    return conversations
+
+
+class RasaTarget(object):
+    def __init__(self, url, concurrency):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=concurrency))
+
+    def conversation(self, sender):
+        def send(text):
+            response = self.session.post(
+                '{}/conversations/{}/respond'.format(self.url, sender), json={"query": text})
+            response.raise_for_status()
+            return response.json()
+        return send
+
+
+class ChatTarget(object):
+    def __init__(self, url, concurrency):
+        self.url = url.rstrip('/')
+
+    def conversation(self, sender):
+        # a session per conversation, app.py gives each cookie its own tracker
+        session = requests.Session()
+
+        def send(text):
+            response = session.post('{}/chat'.format(self.url), data={"text": text})
+            response.raise_for_status()
+            return response.json()
+        return send
+
+
+def percentile(latencies, p):
+    if not latencies:
+        return 0.0
+    return latencies[max(0, int(math.ceil(p / 100.0 * len(latencies))) - 1)]
+
+
+def run(target, conversations, concurrency, repeat=1):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def play(sender, texts):
+        send = target.conversation(sender)
+        for text in texts:
+            start = time.time()
+            try:
+                send(text)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(time.time() - start)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(play, '{}-{}-{}'.format(sender, r, int(start)), texts)
+                   for r in range(repeat) for sender, texts in conversations]
+        for future in futures:
+            future.result()
+    duration = time.time() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies) + errors[0],
+        "errors": errors[0],
+        "duration": duration,
+        "throughput": len(latencies) / duration if duration else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def report(stats):
+    print("requests   {}".format(stats["requests"]))
+    print("errors     {}".format(stats["errors"]))
+    print("duration   {:.2f} s".format(stats["duration"]))
+    print("throughput {:.1f} req/s".format(stats["throughput"]))
+    for p in ("p50", "p95", "p99"):
+        print("{:<10} {:.1f} ms".format(p, stats[p] * 1000))
+
+
+# Local stubs
+STUB_WEATHER = {
+    "location": {"name": "London", "country": "United Kingdom"},
+    "current": {"condition": {"text": "Partly cloudy"}, "temp_c": 15.0,
+                "humidity": 72, "wind_mph": 8.1},
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0
+
+    def _json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        match = re.match(r'^/conversations/([^/]+)/respond', self.path)
+        if not match:
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        query = json.loads(self.rfile.read(length).decode('utf-8') or '{}').get('query', '')
+        time.sleep(self.delay)
+        self._json([{"recipient_id": match.group(1), "text": "You said: {}".format(query)}])
+
+    def do_GET(self):
+        if not self.path.startswith('/v1/current.json'):
+            self.send_error(404)
+            return
+        time.sleep(self.delay)
+        self._json(STUB_WEATHER)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_stub(port, delay=0):
+    handler = type('Handler', (StubHandler,), {'delay': delay})
+    server = StubServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the chat stack')
+    parser.add_argument('--target', choices=['chat', 'rasa'], default='chat')
+    parser.add_argument('--url', help='defaults to the stub with --stub, else to app.py or the Rasa server')
+    parser.add_argument('--source', action='append',
+                        help="'data', 'stories' or a jsonl file of {sender, text}, repeatable")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--stub', action='store_true', help='serve the Rasa and Apixu stubs')
+    parser.add_argument('--stub-port', type=int, default=5055)
+    parser.add_argument('--stub-delay', type=float, default=0, help='seconds')
+    args = parser.parse_args()
+
+    if args.stub:
+        start_stub(args.stub_port, args.stub_delay)
+        print("stubs listening on http://127.0.0.1:{}".format(args.stub_port))
+    url = args.url
+    if url is None:
+        if args.target == 'rasa':
+            url = 'http://127.0.0.1:{}'.format(args.stub_port) if args.stub else 'http://localhost:5005'
+        else:
+            url = 'http://localhost:5000'
+    target = (RasaTarget if args.target == 'rasa' else ChatTarget)(url, args.concurrency)
+    conversations = load_conversations(args.source or ['data', 'stories'])
+    report(run(target, conversations, args.concurrency, args.repeat))
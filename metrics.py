@@ -0,0 +1,66 @@
+import bisect
+import resource
+import threading
+
+# process wide counters and histograms, exposed by the /metrics route of app.py
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_collectors = {}
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def inc(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def observe(name, value):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = {"count": 0, "sum": 0.0, "buckets": [0] * (len(BUCKETS) + 1)}
+        histogram["count"] += 1
+        histogram["sum"] += value
+        histogram["buckets"][bisect.bisect_left(BUCKETS, value)] += 1
+
+
+def _histogram_snapshot(histogram):
+    # cumulative counts per upper bound, as in prometheus
+    buckets = {}
+    total = 0
+    for bound, count in zip(BUCKETS + ("+Inf",), histogram["buckets"]):
+        total += count
+        buckets[str(bound)] = total
+    return {"count": histogram["count"], "sum": histogram["sum"], "buckets": buckets}
+
+
+def resident_memory():
+    # current resident set size of the process in bytes
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def register(name, collector):
+    # collector is a callable returning a dict, evaluated on every snapshot
+    _collectors[name] = collector
+
+
+def snapshot():
+    with _lock:
+        data = dict(_counters)
+        if _histograms:
+            data["histograms"] = {name: _histogram_snapshot(h) for name, h in _histograms.items()}
+    for name, collector in list(_collectors.items()):
+        data[name] = collector()
+    return data
@@ -0,0 +1,113 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+
+from rasa_nlu.classifiers.sklearn_intent_classifier import SklearnIntentClassifier
+from rasa_nlu.extractors.crf_entity_extractor import CRFEntityExtractor
+from rasa_nlu.model import Metadata
+
+from numpy_classifier import ARRAYS, LinearSVCPredictor, NumpyIntentClassifier
+
+# Fast loading copy of a trained NLU model: the intent classifier becomes
+# memory mapped .npy arrays and the CRF its raw crfsuite file, so loading
+# neither unpickles nor imports scikit-learn, and several worker processes
+# share the same pages. The bundle is a regular model directory with a
+# manifest.json, load it with Interpreter.load or NLU_MODEL.
+#
+#   python model_bundle.py [model_dir] [bundle_dir]
+#
+# spaCy still loads its own vectors.
+
+CRF_FILE_NAME = "crf_model.crfsuite"
+CLASSIFIER_DIR = "intent_classifier"
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class MappedCRFEntityExtractor(CRFEntityExtractor):
+    # ner_crf reading the crfsuite model file directly
+
+    @classmethod
+    def load(cls, model_dir=None, model_metadata=None, cached_component=None, **kwargs):
+        from sklearn_crfsuite import CRF
+
+        meta = model_metadata.for_component(cls.name)
+        model_file = os.path.join(model_dir, meta.get("classifier_file", CRF_FILE_NAME))
+        if os.path.exists(model_file):
+            return cls(meta, CRF(model_filename=model_file))
+        return cls(meta)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build(model_dir, bundle_dir=None):
+    bundle_dir = bundle_dir or model_dir.rstrip('/') + '.bundle'
+    if os.path.exists(bundle_dir):
+        shutil.rmtree(bundle_dir)
+    os.makedirs(bundle_dir)
+
+    metadata = Metadata.load(model_dir)
+    pipeline = []
+    for component in metadata.get('pipeline', []):
+        component = dict(component)
+        if component.get('name') == SklearnIntentClassifier.name:
+            classifier = SklearnIntentClassifier.load(model_dir, metadata)
+            if classifier.clf is not None:
+                LinearSVCPredictor.from_sklearn(classifier).save_arrays(os.path.join(bundle_dir, CLASSIFIER_DIR))
+            component.update({"name": NumpyIntentClassifier.name,
+                              "class": "numpy_classifier.NumpyIntentClassifier",
+                              "classifier_dir": CLASSIFIER_DIR})
+            component.pop("classifier_file", None)
+        elif component.get('name') == CRFEntityExtractor.name:
+            extractor = CRFEntityExtractor.load(model_dir, metadata)
+            if extractor.ent_tagger is not None:
+                shutil.copyfile(extractor.ent_tagger.modelfile.name, os.path.join(bundle_dir, CRF_FILE_NAME))
+            component.update({"class": "model_bundle.MappedCRFEntityExtractor",
+                              "classifier_file": CRF_FILE_NAME})
+        pipeline.append(component)
+
+    # the other files the components need, such as the regex features
+    for entry in os.listdir(model_dir):
+        path = os.path.join(model_dir, entry)
+        if os.path.isfile(path) and not entry.endswith('.pkl') and entry != 'metadata.json':
+            shutil.copyfile(path, os.path.join(bundle_dir, entry))
+
+    data = dict(metadata.metadata, pipeline=pipeline)
+    with io.open(os.path.join(bundle_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, indent=4))
+
+    manifest = {"source": os.path.abspath(model_dir),
+                "rasa_nlu_version": data.get("rasa_nlu_version"),
+                "trained_at": data.get("trained_at"),
+                "arrays": [os.path.join(CLASSIFIER_DIR, name + ".npy") for name in ARRAYS],
+                "files": {}}
+    for root, _, files in os.walk(bundle_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            manifest["files"][os.path.relpath(path, bundle_dir)] = {
+                "bytes": os.path.getsize(path), "sha256": file_digest(path)}
+    with io.open(os.path.join(bundle_dir, MANIFEST_FILE_NAME), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(manifest, indent=4, sort_keys=True))
+    return bundle_dir
+
+
+def verify(bundle_dir):
+    # True when every file of the bundle matches its manifest
+    with io.open(os.path.join(bundle_dir, MANIFEST_FILE_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+    return all(os.path.exists(os.path.join(bundle_dir, path))
+               and file_digest(os.path.join(bundle_dir, path)) == entry["sha256"]
+               for path, entry in manifest["files"].items())
+
+
+if __name__ == '__main__':
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else './models/nlu/default/moodnlu'
+    print(build(model_dir, sys.argv[2] if len(sys.argv) > 2 else None))
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Retrained models are picked up without restarting the server: a thread polls
+# the model directory and, once its files stopped changing, loads and warms the
+# new version in the background before handing it over to swap. The model in
+# use keeps serving meanwhile, requests already running finish on it and it is
+# released with their last reference.
+# seconds between two checks of the model directory, 0 disables the watchers
+MODEL_CHECK_INTERVAL = float(os.environ.get('MODEL_CHECK_INTERVAL', 1))
+
+
+def model_signature(model_directory):
+    # changes whenever a file of the model is written
+    signature = []
+    for entry in sorted(os.listdir(model_directory)):
+        path = os.path.join(model_directory, entry)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            signature.append((entry, stat.st_mtime, stat.st_size))
+    return tuple(signature)
+
+
+class ModelWatcher(object):
+    def __init__(self, model_directory, load, swap, name, interval=MODEL_CHECK_INTERVAL):
+        # load(model_directory) returns a warm model, swap(model) puts it in use
+        self.model_directory = model_directory
+        self.load = load
+        self.swap = swap
+        self.interval = interval
+        self.signature = model_signature(model_directory)
+        self.pending = None
+        self.swaps = 0
+        self.failures = 0
+        metrics.register(name, self.stats)
+
+    def start(self):
+        if self.interval > 0:
+            threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Failed to check the model in {}".format(self.model_directory))
+
+    def check(self):
+        # True when a new version was swapped in
+        try:
+            signature = model_signature(self.model_directory)
+        except OSError:
+            # the directory is being replaced
+            return False
+        if signature == self.signature:
+            return False
+        if signature != self.pending:
+            # still being written, wait for the next check
+            self.pending = signature
+            return False
+        self.signature = signature
+        try:
+            model = self.load(self.model_directory)
+        except Exception:
+            self.failures += 1
+            logger.exception("Failed to load the model in {}, keeping the current one".format(
+                self.model_directory))
+            return False
+        self.swap(model)
+        self.swaps += 1
+        return True
+
+    def stats(self):
+        return {"swaps": self.swaps, "failures": self.failures}
+
+
+def _isolate(policy, graph, session):
+    # runs the predictions of a keras policy in its own graph and session
+    predict = policy.predict_action_probabilities
+
+    def predict_action_probabilities(tracker, domain):
+        with graph.as_default(), session.as_default():
+            return predict(tracker, domain)
+
+    policy.graph = graph
+    policy.predict_action_probabilities = predict_action_probabilities
+
+
+def load_agent(model_directory, interpreter):
+    # a warm dialogue agent, with its keras graph apart from the one in use so
+    # that the old graph can be freed after the swap
+    import tensorflow as tf
+    from rasa_core.agent import Agent
+    from rasa_core.policies.keras_policy import KerasPolicy
+
+    graph = tf.Graph()
+    session = tf.Session(graph=graph)
+    with graph.as_default(), session.as_default():
+        agent = Agent.load(model_directory, interpreter=interpreter)
+    for policy in agent.policy_ensemble.policies:
+        if isinstance(policy, KerasPolicy):
+            _isolate(policy, graph, session)
+
+    # the tracker store of a new agent is empty until swap_agent
+    tracker = agent.tracker_store.init_tracker('model_warmup')
+    agent.policy_ensemble.probabilities_using_best_policy(tracker, agent.domain)
+    return agent
+
+
+def swap_agent(old, new):
+    # the conversations carry over to the new agent
+    new.tracker_store = old.tracker_store
+    new.tracker_store.domain = new.domain
+    return new
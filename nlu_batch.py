@@ -0,0 +1,80 @@
+import time
+from itertools import islice
+
+import numpy as np
+from rasa_nlu.classifiers import INTENT_RANKING_LENGTH
+from rasa_nlu.classifiers.sklearn_intent_classifier import SklearnIntentClassifier
+from rasa_nlu.extractors.crf_entity_extractor import CRFEntityExtractor
+from rasa_nlu.model import Interpreter
+from rasa_nlu.training_data import Message
+from rasa_nlu.utils.spacy_utils import SpacyNLP
+
+import metrics
+from numpy_classifier import NumpyIntentClassifier
+
+# Batched parsing, used by the servers: the components that can, such as spaCy,
+# the intent classifiers and the crf, run once on a whole batch of messages.
+# Kept apart from nlu_model.py so that serving does not import the training
+# code and scikit-learn.
+
+
+def process_batch(component, messages, context):
+    # same as component.process on every message, with a single call to
+    # spacy, the intent classifier and the crf for the whole batch. False
+    # when the component did process the messages one by one
+    if isinstance(component, SpacyNLP):
+        if component.component_config.get("case_sensitive"):
+            texts = [message.text for message in messages]
+        else:
+            texts = [message.text.lower() for message in messages]
+        for message, doc in zip(messages, component.nlp.pipe(texts, batch_size=len(texts))):
+            message.set("spacy_doc", doc)
+    elif isinstance(component, SklearnIntentClassifier) and component.clf is not None:
+        X = np.stack([message.get("text_features") for message in messages])
+        probabilities = component.predict_prob(X)
+        for message, row in zip(messages, probabilities):
+            order = np.argsort(row)[::-1][:INTENT_RANKING_LENGTH]
+            names = component.transform_labels_num2str(order)
+            ranking = [{"name": name, "confidence": row[i]} for name, i in zip(names, order)]
+            message.set("intent", ranking[0], add_to_output=True)
+            message.set("intent_ranking", ranking, add_to_output=True)
+    elif isinstance(component, NumpyIntentClassifier) and component.predictor is not None:
+        X = np.stack([message.get("text_features") for message in messages])
+        for message, row in zip(messages, component.predictor.predict_proba(X)):
+            intent, ranking = component.predictor.rank(row)
+            message.set("intent", intent, add_to_output=True)
+            message.set("intent_ranking", ranking, add_to_output=True)
+    elif isinstance(component, CRFEntityExtractor) and component.ent_tagger is not None:
+        features = [component._sentence_to_features(component._from_text_to_crf(message)) for message in messages]
+        for message, marginals in zip(messages, component.ent_tagger.predict_marginals(features)):
+            extracted = component.add_extractor_name(component._from_crf_to_json(message, marginals))
+            message.set("entities", message.get("entities", []) + extracted, add_to_output=True)
+    else:
+        for message in messages:
+            component.process(message, **context)
+        return False
+    return True
+
+
+def parse_many(texts, batch_size=64, interpreter=None):
+    # same results as interpreter.parse for every text, in order
+    if interpreter is None:
+        from nlu_model import MODEL_DIR
+        interpreter = Interpreter.load(MODEL_DIR)
+    texts = iter(texts)
+    results = []
+    while True:
+        batch = list(islice(texts, batch_size))
+        if not batch:
+            return results
+        messages = [Message(text, interpreter.default_output_attributes()) for text in batch]
+        for component in interpreter.pipeline:
+            start = time.time()
+            batched = process_batch(component, messages, interpreter.context)
+            # an instrumented component already timed each of its process calls
+            if batched or not getattr(component, 'timed', False):
+                metrics.observe('nlu_component_batch_seconds.' + component.name, time.time() - start)
+        for message in messages:
+            output = interpreter.default_output_attributes()
+            output.update(message.as_dict(only_output_properties=True))
+            results.append(output)
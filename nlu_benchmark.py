@@ -0,0 +1,210 @@
+import argparse
+import json
+import multiprocessing
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+from rasa_nlu import config
+from rasa_nlu.model import Interpreter, Trainer
+from rasa_nlu.training_data import TrainingData, load_data
+from sklearn.metrics import f1_score
+
+from metrics import resident_memory
+from nlu_batch import parse_many
+from training_cache import use_cache
+
+# Trains every pipeline config on data/data.json and compares them:
+#
+#   python nlu_benchmark.py config_spacy.json config_spacy_duckling.yml
+#
+# Every HOLDOUT-th example is kept out of training to measure the F1 scores,
+# so the split is always the same. The configs of the repo extract numbers and
+# times in process (duckling_local.py), a config still calling a duckling
+# server, such as the ner_duckling one of earlier versions, is pointed at a
+# local stub that only knows about numbers, so the benchmark runs offline and
+# measures the pipeline rather than the duckling server.
+
+DATA_FILE = './data/data.json'
+CONFIGS = ['config_spacy.json', 'config_spacy_duckling.yml']
+HOLDOUT = 5
+
+
+class DucklingStubHandler(BaseHTTPRequestHandler):
+    # answers /parse like duckling, with the numbers of the text
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        text = parse_qs(self.rfile.read(length).decode('utf-8')).get('text', [''])[0]
+        entities = [{"body": m.group(), "start": m.start(), "end": m.end(), "dim": "number",
+                     "value": {"value": float(m.group()), "type": "value"}, "latent": False}
+                    for m in re.finditer(r'\d+(?:\.\d+)?', text)]
+        body = json.dumps(entities).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DucklingStub(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_duckling_stub():
+    server = DucklingStub(('127.0.0.1', 0), DucklingStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def load_config(path, duckling):
+    # duckling() returns the url of the stub, started on first use
+    cfg = config.load(path)
+    for component in cfg.pipeline:
+        if component.get('name') in ('ner_duckling', 'ner_duckling_http'):
+            component['name'] = 'ner_duckling_http'
+            component['url'] = duckling()
+    return cfg
+
+
+def split(data_file=DATA_FILE):
+    data = load_data(data_file)
+    examples = data.training_examples
+    train = [e for i, e in enumerate(examples) if i % HOLDOUT]
+    test = [e for i, e in enumerate(examples) if not i % HOLDOUT]
+    return (TrainingData(train, data.entity_synonyms, data.regex_features), test)
+
+
+def train(cfg, training_data, model_dir):
+    trainer = use_cache(Trainer(cfg))
+    trainer.train(training_data)
+    return trainer.persist(model_dir, fixed_model_name='benchmark')
+
+
+def entity_f1(expected, predicted):
+    # exact match of (entity, start, end) over all the examples
+    true_positives = 0
+    n_expected = 0
+    n_predicted = 0
+    for gold, guess in zip(expected, predicted):
+        gold = set((e['entity'], e['start'], e['end']) for e in gold)
+        guess = set((e['entity'], e['start'], e['end']) for e in guess)
+        true_positives += len(gold & guess)
+        n_expected += len(gold)
+        n_predicted += len(guess)
+    if not true_positives:
+        return 0.0
+    precision = float(true_positives) / n_predicted
+    recall = float(true_positives) / n_expected
+    return 2 * precision * recall / (precision + recall)
+
+
+def measure(model_directory, test, repeat, results):
+    # runs in its own process so that the memory of one model does not
+    # count for the next one, a failure is sent back instead of the results
+    try:
+        results.put(_measure(model_directory, test, repeat))
+    except Exception:
+        results.put({"error": traceback.format_exc()})
+
+
+def _measure(model_directory, test, repeat):
+    before = resident_memory()
+    start = time.time()
+    interpreter = Interpreter.load(model_directory)
+    load_time = time.time() - start
+    memory = resident_memory() - before
+
+    texts = [e.text for e in test]
+    latencies = []
+    predictions = []
+    for text in texts:
+        start = time.time()
+        predictions.append(interpreter.parse(text))
+        latencies.append(time.time() - start)
+    latencies.sort()
+
+    batch = texts * repeat
+    start = time.time()
+    parse_many(batch, interpreter=interpreter)
+    throughput = len(batch) / (time.time() - start)
+
+    return {
+        "load": load_time,
+        "memory": memory,
+        "p50": latencies[len(latencies) // 2],
+        "mean": sum(latencies) / len(latencies),
+        "throughput": throughput,
+        "intent_f1": f1_score([e.get("intent") for e in test],
+                              [(p.get("intent") or {}).get("name") for p in predictions],
+                              average='weighted'),
+        "entity_f1": entity_f1([e.get("entities", []) for e in test],
+                               [p.get("entities", []) for p in predictions]),
+    }
+
+
+def wait(process, results, poll=1):
+    # the results of the measure process, which may also die without any
+    while True:
+        try:
+            return results.get(timeout=poll)
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    return results.get_nowait()
+                except queue.Empty:
+                    return {"error": "exited with code {}".format(process.exitcode)}
+
+
+def benchmark(configs, repeat=20):
+    stub = []
+
+    def duckling():
+        if not stub:
+            stub.append(start_duckling_stub())
+        return stub[0]
+
+    training_data, test = split()
+    rows = []
+    for path in configs:
+        model_dir = tempfile.mkdtemp()
+        try:
+            model_directory = train(load_config(path, duckling), training_data, model_dir)
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=measure, args=(model_directory, test, repeat, results))
+            process.start()
+            row = wait(process, results)
+            process.join()
+        finally:
+            shutil.rmtree(model_dir)
+        if "error" in row:
+            raise RuntimeError("Failed to measure {}: {}".format(path, row["error"]))
+        row["config"] = path
+        rows.append(row)
+    return rows
+
+
+def report(rows):
+    print("{:<28} {:>8} {:>8} {:>8} {:>8} {:>10} {:>9} {:>9}".format(
+        "config", "load s", "RSS MB", "p50 ms", "mean ms", "batch/s", "intent F1", "entity F1"))
+    for row in rows:
+        print("{:<28} {:>8.2f} {:>8.1f} {:>8.2f} {:>8.2f} {:>10.1f} {:>9.3f} {:>9.3f}".format(
+            row["config"], row["load"], row["memory"] / 2.0 ** 20, row["p50"] * 1000,
+            row["mean"] * 1000, row["throughput"], row["intent_f1"], row["entity_f1"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare NLU pipeline configs')
+    parser.add_argument('configs', nargs='*', default=CONFIGS)
+    parser.add_argument('--repeat', type=int, default=20, help='copies of the test set in the batch')
+    args = parser.parse_args()
+    report(benchmark(args.configs, args.repeat))
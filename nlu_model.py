@@ -1,18 +1,127 @@
+import argparse
+import multiprocessing
+import os
+
 from rasa_nlu.training_data import load_data
+from rasa_nlu.training_data import Message, TrainingData
+from rasa_nlu.components import ComponentBuilder
 from rasa_nlu import config
 from rasa_nlu.model import Trainer
 from rasa_nlu.model import Metadata, Interpreter
 
-def train_nlu(data, configs, model_dir):
+from nlu_batch import process_batch
+from training_cache import CachedSpacyNLP, cached_pipeline, read_manifest, training_manifest, use_cache, write_manifest
+
+MODEL_NAME = 'moodnlu'
+MODEL_DIR = './models/nlu/default/' + MODEL_NAME
+# jobs of the intent classifier grid search, -1 uses every core
+TRAIN_THREADS = int(os.environ.get('NLU_TRAIN_THREADS', -1))
+
+def train_nlu(data, configs, model_dir, num_threads=TRAIN_THREADS, force=False):
+	# nothing is done when the data, the config and the libraries did not
+	# change since the model was trained
+	manifest = training_manifest(data, configs)
+	model_directory = os.path.join(model_dir, 'default', MODEL_NAME)
+	if not force and read_manifest(model_directory) == manifest:
+		print("{} is up to date".format(model_directory))
+		return model_directory
+	training_data = load_data(data)
+	trainer = use_cache(Trainer(config.load(configs)))
+	trainer.train(training_data, num_threads=num_threads)
+	model_directory = trainer.persist(model_dir, fixed_model_name = MODEL_NAME)
+	write_manifest(model_directory, manifest)
+	return model_directory
+
+# shared by the evaluation workers, forked once spaCy is loaded
+_builder = None
+
+def _evaluate_fold(args):
+	# trains on the training examples of the fold and predicts the others
+	data, configs, train_index, test_index = args
 	training_data = load_data(data)
-	trainer = Trainer(config.load(configs))
-	trainer.train(training_data)
-	model_directory = trainer.persist(model_dir, fixed_model_name = 'moodnlu')
+	examples = training_data.training_examples
+	trainer = use_cache(Trainer(config.load(configs), _builder))
+	interpreter = trainer.train(TrainingData([examples[i] for i in train_index],
+		training_data.entity_synonyms, training_data.regex_features), num_threads=1)
+	test = [examples[i] for i in test_index]
+	messages = [Message(example.text) for example in test]
+	for component in interpreter.pipeline:
+		if isinstance(component, CachedSpacyNLP):
+			component.set_docs(messages)
+		else:
+			process_batch(component, messages, interpreter.context)
+	results = []
+	for example, message in zip(test, messages):
+		results.append((example.get("intent"), (message.get("intent") or {}).get("name") or "",
+			[(e["entity"], e["start"], e["end"]) for e in example.get("entities", [])],
+			[(e["entity"], e["start"], e["end"]) for e in message.get("entities", [])]))
+	return results
+
+def evaluate(data, configs, folds=5, processes=None):
+	# k-fold cross validation, stratified on the intents, with the folds
+	# trained in parallel. spaCy runs once on every example, the folds read
+	# the analyses from the training cache.
+	from sklearn.metrics import confusion_matrix
+	from sklearn.model_selection import StratifiedKFold
+
+	global _builder
+	training_data = load_data(data)
+	examples = training_data.training_examples
+	_builder = ComponentBuilder(use_cache=True)
+	for component in cached_pipeline(Trainer(config.load(configs), _builder).pipeline):
+		if isinstance(component, CachedSpacyNLP):
+			component.set_docs(examples)
+
+	intents = [example.get("intent") for example in examples]
+	splits = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0).split(examples, intents)
+	jobs = [(data, configs, list(train), list(test)) for train, test in splits]
+	with multiprocessing.Pool(processes or min(folds, multiprocessing.cpu_count())) as pool:
+		fold_results = pool.map(_evaluate_fold, jobs)
+
+	labels = sorted(set(intents))
+	matrices = []
+	counts = {}
+	for results in fold_results:
+		matrices.append(confusion_matrix([r[0] for r in results], [r[1] for r in results], labels=labels))
+		for _, _, gold, predicted in results:
+			gold, predicted = set(gold), set(predicted)
+			for entity, kind in [(e[0], "tp") for e in gold & predicted] + \
+					[(e[0], "fn") for e in gold - predicted] + [(e[0], "fp") for e in predicted - gold]:
+				counts.setdefault(entity, {"tp": 0, "fp": 0, "fn": 0})[kind] += 1
+	entities = {}
+	for entity, count in counts.items():
+		precision = float(count["tp"]) / (count["tp"] + count["fp"]) if count["tp"] + count["fp"] else 0.0
+		recall = float(count["tp"]) / (count["tp"] + count["fn"]) if count["tp"] + count["fn"] else 0.0
+		entities[entity] = {"precision": precision, "recall": recall, "support": count["tp"] + count["fn"]}
+	return {"labels": labels, "confusion": sum(matrices), "folds": matrices, "entities": entities}
+
+def report(evaluation):
+	labels = evaluation["labels"]
+	width = max(len(label) for label in labels + ["predicted"])
+	print("intent confusion matrix over {} folds, true intents in rows".format(len(evaluation["folds"])))
+	print(" ".join(["{:<{}}".format("", width)] + ["{:>{}}".format(label, width) for label in labels]))
+	for label, row in zip(labels, evaluation["confusion"]):
+		print(" ".join(["{:<{}}".format(label, width)] + ["{:>{}}".format(n, width) for n in row]))
+	print("")
+	print("{:<16} {:>9} {:>9} {:>9}".format("entity", "precision", "recall", "support"))
+	for entity, scores in sorted(evaluation["entities"].items()):
+		print("{:<16} {:>9.3f} {:>9.3f} {:>9}".format(
+			entity, scores["precision"], scores["recall"], scores["support"]))
 
 def run_nlu():
-	interpreter=Interpreter.load('./models/nlu/default/moodnlu')
+	interpreter=Interpreter.load(MODEL_DIR)
 	print(interpreter.parse(u"I am planning my holiday to Lithuania. I wonder what is the weather out there."))
 	
 if __name__ == '__main__':
-	train_nlu('./data/data.json', 'config_spacy.json', './models/nlu')
-	run_nlu()
+	parser = argparse.ArgumentParser(description='Train or cross validate the NLU model')
+	parser.add_argument('command', nargs='?', choices=['train', 'evaluate'], default='train')
+	parser.add_argument('--data', default='./data/data.json')
+	parser.add_argument('--config', default='config_spacy.json')
+	parser.add_argument('--folds', type=int, default=5)
+	parser.add_argument('--processes', type=int, help='worker processes, one per fold by default')
+	args = parser.parse_args()
+	if args.command == 'evaluate':
+		report(evaluate(args.data, args.config, args.folds, args.processes))
+	else:
+		train_nlu(args.data, args.config, './models/nlu')
+		run_nlu()
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Flask, jsonify, request
+from rasa_nlu.components import ComponentBuilder
+
+import metrics
+from cache import SingleFlight
+from interpreter import instrument
+from model_watcher import MODEL_CHECK_INTERVAL
+
+# One process serving every NLU model of models/nlu, with the parse API of the
+# rasa_nlu server:
+#
+#   python nlu_server.py
+#   curl 'localhost:5002/parse?q=hello&project=default&model=moodnlu'
+#
+# A model directory is addressed by the name of its parent directory (the
+# project) and its own name, the models found directly in models/nlu belong to
+# the default project. Without model the most recently trained model of the
+# project answers. Models are loaded on their first request and the least
+# recently used ones are unloaded when the memory taken by the loaded models
+# goes over NLU_MEMORY_CAP. The components shared by the models, such as the
+# spaCy language model, are counted once apart and never unloaded.
+NLU_MODELS_ROOT = os.environ.get('NLU_MODELS_ROOT', './models/nlu')
+NLU_PORT = int(os.environ.get('NLU_PORT', 5002))
+# megabytes, the memory of a model being the growth of the resident memory
+# of the process while it loads, less the shared components it loaded first
+NLU_MEMORY_CAP = float(os.environ.get('NLU_MEMORY_CAP', 1024))
+DEFAULT_PROJECT = 'default'
+
+
+class ModelNotFound(Exception):
+    pass
+
+
+def find_models(root=NLU_MODELS_ROOT):
+    # {project: {model: directory}} of every directory holding a metadata.json
+    projects = {}
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        if 'metadata.json' not in files:
+            continue
+        parent = os.path.dirname(directory)
+        project = DEFAULT_PROJECT if os.path.samefile(parent, root) else os.path.basename(parent)
+        projects.setdefault(project, {})[os.path.basename(directory)] = directory
+    return projects
+
+
+class SharedComponentBuilder(ComponentBuilder):
+    # spaCy and the other cacheable components are shared by the models, the
+    # memory taken by the ones loaded so far is in shared_memory
+    def __init__(self):
+        super(SharedComponentBuilder, self).__init__(use_cache=True)
+        self.shared_memory = 0
+
+    def load_component(self, component_name, model_dir, model_metadata, **context):
+        cached = len(self.component_cache)
+        before = metrics.resident_memory()
+        component = super(SharedComponentBuilder, self).load_component(
+            component_name, model_dir, model_metadata, **context)
+        if len(self.component_cache) > cached:
+            self.shared_memory += max(metrics.resident_memory() - before, 0)
+        return component
+
+
+class ModelPool(object):
+    def __init__(self, root=NLU_MODELS_ROOT, memory_cap=NLU_MEMORY_CAP):
+        self.root = root
+        self.memory_cap = memory_cap * 2 ** 20
+        self.builder = SharedComponentBuilder()
+        self.loads = 0
+        self.evictions = 0
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._found = {}
+        self._found_at = 0
+        metrics.register('nlu_models', self.stats)
+
+    def projects(self):
+        # the models directory is scanned again every MODEL_CHECK_INTERVAL seconds
+        if time.time() - self._found_at >= MODEL_CHECK_INTERVAL:
+            self._found = find_models(self.root)
+            self._found_at = time.time()
+        return self._found
+
+    def resolve(self, project=None, model=None):
+        project = project or DEFAULT_PROJECT
+        models = self.projects().get(project)
+        if not models:
+            raise ModelNotFound("No project '{}'".format(project))
+        if model is None:
+            model = max(models, key=lambda name: os.path.getmtime(
+                os.path.join(models[name], 'metadata.json')))
+        if model not in models:
+            raise ModelNotFound("No model '{}' in project '{}'".format(model, project))
+        return project, model, models[model]
+
+    def get(self, project=None, model=None):
+        # (project, model, interpreter), loading the model if needed
+        project, model, directory = self.resolve(project, model)
+        key = (project, model)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+                return project, model, entry[0]
+        interpreter, _ = self._flights.do(key, lambda: self._load(key, directory))
+        return project, model, interpreter
+
+    def _load(self, key, directory):
+        from rasa_nlu.model import Interpreter
+
+        # one load at a time, so that the memory growth is the one of this model
+        with self._load_lock:
+            # a caller arriving just after a load of the model finished
+            # finds it here rather than loading it a second time
+            with self._lock:
+                entry = self._models.get(key)
+                if entry is not None:
+                    self._models.move_to_end(key)
+                    return entry[0]
+            before = metrics.resident_memory()
+            shared = self.builder.shared_memory
+            interpreter = instrument(Interpreter.load(directory, self.builder))
+            size = metrics.resident_memory() - before - (self.builder.shared_memory - shared)
+            size = max(size, 0)
+        with self._lock:
+            self._models[key] = (interpreter, size)
+            self.loads += 1
+            self._evict()
+        return interpreter
+
+    def _evict(self):
+        # the parses running on an evicted model keep it until they return
+        while len(self._models) > 1 and self.memory() > self.memory_cap:
+            self._models.popitem(last=False)
+            self.evictions += 1
+
+    def memory(self):
+        return sum(size for _, size in self._models.values())
+
+    def loaded(self):
+        with self._lock:
+            return [{"project": project, "model": model, "memory": size}
+                    for (project, model), (_, size) in self._models.items()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": len(self._models),
+                "memory": self.memory(),
+                "memory_cap": self.memory_cap,
+                "shared_memory": self.builder.shared_memory,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+app = Flask(__name__)
+# no model is loaded before its first request, so that the app can be
+# imported by a WSGI server as well
+pool = ModelPool()
+
+
+@app.route('/parse', methods=['GET', 'POST'])
+def parse():
+    params = request.get_json(silent=True) if request.method == 'POST' else None
+    params = params or request.values
+    text = params.get('q')
+    if text is None:
+        return jsonify({"error": "Missing the text to parse in q"}), 400
+    try:
+        project, model, interpreter = pool.get(params.get('project'), params.get('model'))
+    except ModelNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    result = interpreter.parse(text)
+    result["project"] = project
+    result["model"] = model
+    return jsonify(result)
+
+
+@app.route('/status')
+def status():
+    projects = pool.projects()
+    return jsonify({
+        "available_projects": {project: sorted(models) for project, models in projects.items()},
+        "loaded": pool.loaded(),
+    })
+
+
+@app.route('/metrics')
+def metrics_view():
+    return jsonify(metrics.snapshot())
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=NLU_PORT, threaded=True)
@@ -0,0 +1,212 @@
+import io
+import json
+import os
+import sys
+
+import numpy as np
+from rasa_nlu.classifiers import INTENT_RANKING_LENGTH
+from rasa_nlu.components import Component
+
+# The linear SVC of intent_classifier_sklearn exported to plain numpy arrays.
+# Prediction is one matmul for the one-vs-one decision values, then the same
+# Platt scaling and pairwise coupling libsvm uses for predict_proba, so no
+# scikit-learn nor pickle is needed at serving time.
+#
+#   python numpy_classifier.py [model_dir] [--replace]
+#
+# exports the classifier of a trained model and checks it against sklearn,
+# --replace also switches the model metadata over to the numpy classifier.
+
+NUMPY_MODEL_FILE_NAME = "intent_classifier_numpy.npz"
+ARRAYS = ("coef", "intercept", "prob_a", "prob_b", "labels")
+
+
+def _couple(pairwise, k):
+    # libsvm multiclass_probability on one sample
+    r = np.zeros((k, k))
+    rows, cols = np.triu_indices(k, 1)
+    r[rows, cols] = pairwise
+    r[cols, rows] = 1 - pairwise
+    Q = -r.T * r
+    Q[np.diag_indices(k)] = (r ** 2).sum(axis=0)
+    p = np.full(k, 1.0 / k)
+    eps = 0.005 / k
+    for _ in range(max(100, k)):
+        Qp = Q.dot(p)
+        pQp = p.dot(Qp)
+        if np.max(np.abs(Qp - pQp)) < eps:
+            break
+        for t in range(k):
+            diff = (-Qp[t] + pQp) / Q[t, t]
+            p[t] += diff
+            pQp = (pQp + diff * (diff * Q[t, t] + 2 * Qp[t])) / (1 + diff) / (1 + diff)
+            Qp = (Qp + diff * Q[t]) / (1 + diff)
+            p /= 1 + diff
+    return p
+
+
+class LinearSVCPredictor(object):
+    def __init__(self, coef, intercept, prob_a, prob_b, labels):
+        self.coef = coef
+        self.intercept = intercept
+        self.prob_a = prob_a
+        self.prob_b = prob_b
+        self.labels = labels
+
+    @classmethod
+    def from_sklearn(cls, classifier):
+        # classifier is a trained SklearnIntentClassifier component
+        svc = getattr(classifier.clf, "best_estimator_", classifier.clf)
+        if svc.kernel != "linear":
+            raise ValueError("Only a linear kernel can be exported, got '{}'".format(svc.kernel))
+        coef = np.asarray(svc.coef_, dtype=np.float64)
+        intercept = np.asarray(svc.intercept_, dtype=np.float64)
+        if len(svc.classes_) == 2:
+            # sklearn flips the sign of the binary decision function, libsvm
+            # calibrated probA/probB on the original one
+            coef, intercept = -coef, -intercept
+        labels = np.asarray([str(label) for label in classifier.transform_labels_num2str(svc.classes_)])
+        return cls(coef, intercept, np.asarray(svc.probA_), np.asarray(svc.probB_), labels)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["coef"], data["intercept"], data["prob_a"], data["prob_b"], data["labels"])
+
+    def save(self, path):
+        np.savez(path, **{name: getattr(self, name) for name in ARRAYS})
+
+    @classmethod
+    def load_arrays(cls, directory, mmap_mode="r"):
+        # one .npy file per array, memory mapped so that processes share pages
+        return cls(*[np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode, allow_pickle=False)
+                     for name in ARRAYS])
+
+    def save_arrays(self, directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+
+    def predict_proba(self, X):
+        decision = X.dot(self.coef.T) + self.intercept
+        fApB = decision * self.prob_a + self.prob_b
+        with np.errstate(over="ignore"):
+            pairwise = np.where(fApB >= 0, np.exp(-fApB) / (1.0 + np.exp(-fApB)), 1.0 / (1.0 + np.exp(fApB)))
+        pairwise = np.clip(pairwise, 1e-7, 1 - 1e-7)
+        k = len(self.labels)
+        return np.array([_couple(row, k) for row in pairwise])
+
+    def rank(self, probabilities):
+        # intent and intent_ranking of one row of predict_proba
+        order = np.argsort(probabilities)[::-1][:INTENT_RANKING_LENGTH]
+        ranking = [{"name": self.labels[i], "confidence": probabilities[i]} for i in order]
+        return ranking[0], ranking
+
+
+class NumpyIntentClassifier(Component):
+    # trained like intent_classifier_sklearn, served by numpy
+
+    name = "intent_classifier_numpy"
+
+    provides = ["intent", "intent_ranking"]
+
+    requires = ["text_features"]
+
+    defaults = {
+        "C": [1, 2, 5, 10, 20, 100],
+        "kernels": ["linear"],
+        "max_cross_validation_folds": 5
+    }
+
+    def __init__(self, component_config=None, predictor=None):
+        super(NumpyIntentClassifier, self).__init__(component_config)
+        self.predictor = predictor
+
+    @classmethod
+    def required_packages(cls):
+        return ["numpy"]
+
+    def train(self, training_data, cfg, **kwargs):
+        from rasa_nlu.classifiers.sklearn_intent_classifier import SklearnIntentClassifier
+
+        config = dict(self.component_config, kernels=["linear"])
+        classifier = SklearnIntentClassifier(config)
+        classifier.train(training_data, cfg, **kwargs)
+        if classifier.clf is not None:
+            self.predictor = LinearSVCPredictor.from_sklearn(classifier)
+
+    def process(self, message, **kwargs):
+        if self.predictor is None:
+            intent, intent_ranking = None, []
+        else:
+            X = message.get("text_features").reshape(1, -1)
+            intent, intent_ranking = self.predictor.rank(self.predictor.predict_proba(X)[0])
+        message.set("intent", intent, add_to_output=True)
+        message.set("intent_ranking", intent_ranking, add_to_output=True)
+
+    def persist(self, model_dir):
+        if self.predictor is not None:
+            self.predictor.save(os.path.join(model_dir, NUMPY_MODEL_FILE_NAME))
+        return {"classifier_file": NUMPY_MODEL_FILE_NAME}
+
+    @classmethod
+    def load(cls, model_dir=None, model_metadata=None, cached_component=None, **kwargs):
+        meta = model_metadata.for_component(cls.name)
+        if meta.get("classifier_dir"):
+            # model bundle, see model_bundle.py
+            predictor = LinearSVCPredictor.load_arrays(os.path.join(model_dir, meta["classifier_dir"]))
+            return cls(meta, predictor)
+        path = os.path.join(model_dir, meta.get("classifier_file", NUMPY_MODEL_FILE_NAME))
+        predictor = LinearSVCPredictor.load(path) if os.path.exists(path) else None
+        return cls(meta, predictor)
+
+
+def check(sklearn_classifier, predictor, X):
+    # the exported predictor must agree with sklearn on every row of X
+    expected = sklearn_classifier.predict_prob(X)
+    got = predictor.predict_proba(X)
+    if not np.array_equal(np.argmax(expected, axis=1), np.argmax(got, axis=1)):
+        raise ValueError("The numpy classifier predicts other intents than sklearn")
+    if not np.allclose(expected, got, atol=1e-6):
+        raise ValueError("The numpy classifier probabilities differ from sklearn by {}".format(
+            np.max(np.abs(expected - got))))
+
+
+def export(model_dir, replace=False):
+    from rasa_nlu.classifiers.sklearn_intent_classifier import SklearnIntentClassifier
+    from rasa_nlu.model import Interpreter
+    from rasa_nlu.training_data import Message
+    from nlu_batch import process_batch
+
+    interpreter = Interpreter.load(model_dir)
+    index, classifier = next((i, c) for i, c in enumerate(interpreter.pipeline)
+                             if isinstance(c, SklearnIntentClassifier))
+    predictor = LinearSVCPredictor.from_sklearn(classifier)
+
+    # checked on the training examples, featurized by the model itself
+    with io.open(os.path.join(model_dir, "training_data.json"), encoding="utf-8") as f:
+        examples = json.load(f)["rasa_nlu_data"]["common_examples"]
+    messages = [Message(example["text"]) for example in examples]
+    for component in interpreter.pipeline[:index]:
+        process_batch(component, messages, interpreter.context)
+    check(classifier, predictor, np.stack([m.get("text_features") for m in messages]))
+
+    predictor.save(os.path.join(model_dir, NUMPY_MODEL_FILE_NAME))
+    if replace:
+        metadata_file = os.path.join(model_dir, "metadata.json")
+        with io.open(metadata_file, encoding="utf-8") as f:
+            metadata = json.load(f)
+        for component in metadata["pipeline"]:
+            if component.get("name") == SklearnIntentClassifier.name:
+                component["name"] = NumpyIntentClassifier.name
+                component["class"] = "numpy_classifier.NumpyIntentClassifier"
+                component["classifier_file"] = NUMPY_MODEL_FILE_NAME
+        with io.open(metadata_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps(metadata, indent=4))
+    return predictor
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != "--replace"]
+    export(args[0] if args else './models/nlu/default/moodnlu', "--replace" in sys.argv)
@@ -0,0 +1,211 @@
+import bisect
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Rasa Core servers launched with `python -m rasa_core.server ...`, one per
+# port. Each worker keeps its own trackers, so a conversation must always be
+# sent to the same worker.
+RASA_URLS = os.environ.get('RASA_URLS', os.environ.get('RASA_URL', 'http://localhost:5005')).split(',')
+RASA_URLS = [url.strip().rstrip('/') for url in RASA_URLS if url.strip()]
+POOL_SIZE = int(os.environ.get('RASA_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.environ.get('RASA_CONNECT_TIMEOUT', 0.5))
+READ_TIMEOUT = float(os.environ.get('RASA_READ_TIMEOUT', 10))
+# answers slower than the budget count as failures, after BREAKER_FAILURES
+# failures in a row the worker is skipped for BREAKER_RESET seconds. The budget
+# also caps READ_TIMEOUT, no request waits longer than it
+LATENCY_BUDGET = float(os.environ.get('RASA_LATENCY_BUDGET', 2))
+BREAKER_FAILURES = int(os.environ.get('RASA_BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.environ.get('RASA_BREAKER_RESET', 30))
+
+# one keep-alive session for the whole process, so a chat turn reuses an open
+# connection instead of paying the TCP setup every time
+_adapter = HTTPAdapter(pool_connections=len(RASA_URLS), pool_maxsize=POOL_SIZE)
+session = requests.Session()
+session.mount('http://', _adapter)
+session.mount('https://', _adapter)
+
+
+class HashRing(object):
+    # consistent hashing: adding or removing a worker only moves the
+    # conversations of that worker
+    def __init__(self, nodes, replicas=100):
+        self.ring = []
+        for node in nodes:
+            for i in range(replicas):
+                self.ring.append((self._hash('{}#{}'.format(node, i)), node))
+        self.ring.sort()
+        self.keys = [key for key, _ in self.ring]
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+    def get(self, key):
+        index = bisect.bisect(self.keys, self._hash(key)) % len(self.ring)
+        return self.ring[index][1]
+
+
+ring = HashRing(RASA_URLS)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+# answer given right away while a server is not responding
+BUSY_ANSWER = "I need a moment to gather my thoughts, could you say that again in a little while?"
+
+
+class CircuitBreaker(object):
+    # closed: requests go through. open: requests fail at once. half open:
+    # after reset_timeout a single request is let through to probe the worker
+    def __init__(self, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.max_failures = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        # a half open breaker let a request through and waits for its outcome
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at < self.reset_timeout:
+                return False
+            # let this request probe the worker, the others keep failing fast
+            self.opened_at = time.time()
+            self.probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        # a trip is counted when the breaker opens, from closed or from a
+        # failed probe, not for the requests failing while it is open
+        with self._lock:
+            self.failures += 1
+            if (self.opened_at is None and self.failures >= self.max_failures) or self.probing:
+                self.opened_at = time.time()
+                self.probing = False
+                self.trips += 1
+
+    def record(self, elapsed):
+        if elapsed > LATENCY_BUDGET:
+            self.failure()
+        else:
+            self.success()
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "trips": self.trips}
+
+
+breakers = {url: CircuitBreaker() for url in RASA_URLS}
+
+
+def route(sender_id):
+    # respond url of the worker holding the conversation, fails fast while
+    # the breaker of that worker is open
+    worker = ring.get(sender_id)
+    breaker = breakers[worker]
+    if not breaker.allow():
+        metrics.inc('rasa_breaker_rejections')
+        raise CircuitOpen(worker)
+    url = '{}/conversations/{}/respond'.format(
+        worker, requests.utils.quote(sender_id, safe=''))
+    return url, breaker
+
+
+def respond(sender_id, text, timeout=None):
+    url, breaker = route(sender_id)
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, min(READ_TIMEOUT, LATENCY_BUDGET))
+    start = time.time()
+    try:
+        response = session.post(url, json={"query": text}, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+    except Exception:
+        breaker.failure()
+        raise
+    breaker.record(time.time() - start)
+    return result
+
+
+def respond_stream(sender_id, text):
+    # the server only answers once the whole turn is done, all the messages
+    # are then yielded at once
+    for message in respond(sender_id, text):
+        yield message
+
+
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE)
+
+
+def respond_many(messages):
+    # messages is a list of (sender_id, text). The messages of one sender are
+    # sent in order, different senders are sent concurrently over the pool.
+    by_sender = OrderedDict()
+    for index, (sender_id, text) in enumerate(messages):
+        by_sender.setdefault(sender_id, []).append((index, text))
+    results = [[] for _ in messages]
+
+    def run(sender_id, items):
+        for index, text in items:
+            try:
+                results[index] = respond(sender_id, text)
+            except Exception:
+                metrics.inc('chat_batch_errors')
+
+    futures = [_executor.submit(run, sender_id, items)
+               for sender_id, items in by_sender.items()]
+    for future in futures:
+        future.result()
+    return results
+
+
+def pool_stats():
+    # every request on a pool is a hit unless it had to open a new connection
+    requests_made = 0
+    connections = 0
+    pools = _adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        requests_made += pool.num_requests
+        connections += pool.num_connections
+    return {
+        "pool_size": POOL_SIZE,
+        "workers": len(RASA_URLS),
+        "requests": requests_made,
+        "pool_hits": requests_made - connections,
+        "pool_misses": connections,
+    }
+
+
+metrics.register('rasa_pool', pool_stats)
+metrics.register('rasa_breakers', lambda: {url: breaker.stats() for url, breaker in breakers.items()})
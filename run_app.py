@@ -1,9 +1,9 @@
 from rasa_core.channels import HttpInputChannel
 from rasa_core.agent import Agent
-from rasa_core.interpreter import RasaNLUInterpreter
+from interpreter import CachedInterpreter
 #from rasa_slack_connector import SlackInput
 
-nlu_interpreter = RasaNLUInterpreter('./models/nlu/default/moodnlu')
+nlu_interpreter = CachedInterpreter('./models/nlu/default/moodnlu')
 agent = Agent.load('./models/dialogue',interpreter = nlu_interpreter)
 
 
@@ -1,10 +1,17 @@
-from rasa_core.channels import HttpInputChannel
-from rasa_core.agent import Agent
-from rasa_core.interpreter import RasaNLUInterpreter
+import json
+import os
+
+from rasa_core.server import RasaCoreServer
+
+import metrics
+from interpreter import CachedInterpreter
+from model_watcher import ModelWatcher, load_agent, swap_agent
 #from rasa_slack_connector import SlackInput
 
-nlu_interpreter = RasaNLUInterpreter('./models/nlu/default/moodnlu')
-agent = Agent.load('./models/dialogue',interpreter = nlu_interpreter)
+NLU_MODEL = os.environ.get('NLU_MODEL', './models/nlu/default/moodnlu')
+DIALOGUE_MODEL = os.environ.get('DIALOGUE_MODEL', './models/dialogue')
+
+nlu_interpreter = CachedInterpreter(NLU_MODEL)
 
 
 # With Slack
@@ -13,6 +20,29 @@ agent = Agent.load('./models/dialogue',interpreter = nlu_interpreter)
 
 #agent.handle_channel(HttpInputChannel(5004,'/',input_channel))
 
+
+class MetricsServer(RasaCoreServer):
+    # the component timings, caches and model swaps of this process, as on
+    # the /metrics route of app.py
+    app = RasaCoreServer.app
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_view(self, request):
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps(metrics.snapshot())
+
+
 # With inner app
-input_channel = SlackInput('OAuth Access Token','Bot User OAuth Access Token', 'Verification Token',True)
-agent.handle_channel(HttpInputChannel(5000,'/',input_channel))
+# same endpoints as python -m rasa_core.server plus /metrics, but a retrained
+# NLU or dialogue model is swapped in without restarting. Every request reads
+# server.agent once, so the ones in progress finish on the previous agent.
+server = MetricsServer(DIALOGUE_MODEL, interpreter=nlu_interpreter, cors_origins=['*'])
+
+
+def swap(agent):
+    server.agent = swap_agent(server.agent, agent) if server.agent else agent
+
+
+watcher = ModelWatcher(DIALOGUE_MODEL, lambda path: load_agent(path, nlu_interpreter), swap,
+                       'dialogue_model_swaps').start()
+server.app.run('0.0.0.0', int(os.environ.get('RASA_PORT', 5005)))
@@ -42,6 +42,24 @@ function showUserMessage(msg){
 }
 function sayToBot(text){
     document.getElementById("msg_input").placeholder = "Type your messages here..."
+    if(!window.EventSource){
+        postToBot(text);
+        return;
+    }
+    // every bot message is shown as soon as the server sends it
+    var source = new EventSource("/chat/stream?text=" + encodeURIComponent(text));
+    source.onmessage = function (e) {
+        var message = JSON.parse(e.data);
+        if(message.text){showBotMessage(message.text);}
+    };
+    source.addEventListener("end", function (e) {
+        source.close();
+    });
+    source.onerror = function (e) {
+        source.close();
+    };
+}
+function postToBot(text){
     $.post("/chat",
             {
                 //csrfmiddlewaretoken:csrf,
@@ -0,0 +1,146 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+
+from rasa_nlu.extractors import EntityExtractor
+
+from cache import normalize
+
+logger = logging.getLogger(__name__)
+
+# Maps the entity values to their canonical value ("uk" -> "United Kingdom",
+# "furious" -> "angry"), like ner_synonyms but for large synonym sets:
+#
+#   - name: "synonyms.SynonymMapper"
+#
+# The synonyms come from the training data and from data/synonyms.json, in the
+# entity_synonyms format of rasa_nlu. They are indexed on the case folded text
+# with collapsed whitespace, so that multi word keys ("great britain") match
+# however they are spaced. The index is saved with the model as 64 bit hashes
+# of the keys pointing into a table of the canonical values.
+SYNONYMS_FILE = './data/synonyms.json'
+SYNONYMS_MODEL_FILE_NAME = "entity_synonyms.bin"
+MAGIC = b"SYN1"
+
+
+def synonym_key(text):
+    return normalize(text).strip(' !?.,;:')
+
+
+def key_hash(key):
+    return struct.unpack("<Q", hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest())[0]
+
+
+class SynonymIndex(object):
+    def __init__(self, hashes=None, values=None):
+        # hash of a key -> index of its value in values
+        self.hashes = hashes or {}
+        self.values = values or []
+
+    @classmethod
+    def from_synonyms(cls, synonyms):
+        # synonyms is {text: canonical value}
+        index = cls()
+        positions = {}
+        for text, value in synonyms.items():
+            if value not in positions:
+                positions[value] = len(index.values)
+                index.values.append(value)
+            for key in (synonym_key(text), synonym_key(value)):
+                index.hashes[key_hash(key)] = positions[value]
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with io.open(path, "rb") as f:
+            data = f.read()
+        if data[:4] != MAGIC:
+            raise ValueError("'{}' is not a synonym index".format(path))
+        n_values, n_keys = struct.unpack_from("<II", data, 4)
+        offset = 12
+        values = []
+        for _ in range(n_values):
+            length, = struct.unpack_from("<I", data, offset)
+            values.append(data[offset + 4:offset + 4 + length].decode("utf-8"))
+            offset += 4 + length
+        entries = struct.iter_unpack("<QI", data[offset:offset + n_keys * 12])
+        return cls(dict(entries), values)
+
+    def save(self, path):
+        encoded = [value.encode("utf-8") for value in self.values]
+        with io.open(path, "wb") as f:
+            f.write(MAGIC + struct.pack("<II", len(encoded), len(self.hashes)))
+            for value in encoded:
+                f.write(struct.pack("<I", len(value)) + value)
+            f.write(b"".join(struct.pack("<QI", h, i) for h, i in sorted(self.hashes.items())))
+
+    def get(self, text):
+        position = self.hashes.get(key_hash(synonym_key(text)))
+        return None if position is None else self.values[position]
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def read_synonyms(path):
+    # [{"value": ..., "synonyms": [...]}] -> {synonym: value}
+    with io.open(path, encoding="utf-8") as f:
+        return {synonym: entry["value"] for entry in json.load(f) for synonym in entry["synonyms"]}
+
+
+class SynonymMapper(EntityExtractor):
+    name = "ner_synonyms_indexed"
+
+    provides = ["entities"]
+
+    defaults = {
+        # synonyms known in advance, added to the ones of the training data
+        "synonyms": SYNONYMS_FILE
+    }
+
+    def __init__(self, component_config=None, index=None):
+        super(SynonymMapper, self).__init__(component_config)
+        self.index = index
+
+    def train(self, training_data, cfg, **kwargs):
+        synonyms = {}
+        if self.component_config["synonyms"] and os.path.exists(self.component_config["synonyms"]):
+            synonyms.update(read_synonyms(self.component_config["synonyms"]))
+        synonyms.update(training_data.entity_synonyms)
+        for example in training_data.entity_examples:
+            for entity in example.get("entities", []):
+                text = example.text[entity["start"]:entity["end"]]
+                value = str(entity.get("value"))
+                if text != value:
+                    synonyms[text] = value
+        conflicts = {}
+        for text, value in synonyms.items():
+            if conflicts.setdefault(synonym_key(text), value) != value:
+                logger.warning("'{}' is a synonym of both '{}' and '{}', keeping '{}'".format(
+                    text, conflicts[synonym_key(text)], value, value))
+        self.index = SynonymIndex.from_synonyms(synonyms)
+
+    def process(self, message, **kwargs):
+        if not self.index:
+            return
+        entities = message.get("entities", [])
+        for entity in entities:
+            value = self.index.get(str(entity["value"]))
+            if value is not None and value != entity["value"]:
+                entity["value"] = value
+                entity["processors"] = entity.get("processors", []) + [self.name]
+        message.set("entities", entities, add_to_output=True)
+
+    def persist(self, model_dir):
+        if self.index is not None:
+            self.index.save(os.path.join(model_dir, SYNONYMS_MODEL_FILE_NAME))
+        return {"synonyms_file": SYNONYMS_MODEL_FILE_NAME}
+
+    @classmethod
+    def load(cls, model_dir=None, model_metadata=None, cached_component=None, **kwargs):
+        meta = model_metadata.for_component(cls.name)
+        path = os.path.join(model_dir, meta.get("synonyms_file", SYNONYMS_MODEL_FILE_NAME))
+        return cls(meta, SynonymIndex.load(path) if os.path.exists(path) else None)
@@ -0,0 +1,166 @@
+import hashlib
+import io
+import json
+import os
+import struct
+
+import numpy
+import rasa_nlu
+import spacy
+from rasa_nlu.utils.spacy_utils import SpacyNLP
+from spacy.tokens import Doc
+
+from gazetteer import GAZETTEER_FILE
+from synonyms import SYNONYMS_FILE
+
+# The spaCy analyses of the training examples are kept on disk, one entry per
+# example text, so that retraining, after changing the classifier grid or
+# adding a few examples, only runs spaCy on the texts it never saw. The cache
+# file depends on what changes the analyses: the spaCy model, its version
+# and the case sensitivity.
+CACHE_DIR = os.environ.get('NLU_CACHE_DIR', './models/nlu/.cache')
+# data read by the custom components at training time
+RESOURCE_FILES = (GAZETTEER_FILE, SYNONYMS_FILE)
+
+
+def write_frames(path, frames):
+    # length prefixed byte strings, the file is replaced atomically
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        for frame in frames:
+            f.write(struct.pack('>I', len(frame)))
+            f.write(frame)
+    os.rename(tmp, path)
+
+
+def read_frames(path):
+    frames = []
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return frames
+            size = struct.unpack('>I', header)[0]
+            frame = f.read(size)
+            if len(frame) < size:
+                return frames
+            frames.append(frame)
+
+
+def spacy_config(component):
+    return {"model": component.component_config.get("model"),
+            "case_sensitive": bool(component.component_config.get("case_sensitive")),
+            "spacy_version": spacy.__version__}
+
+
+def digest(value):
+    if not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(value).hexdigest()
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return digest(f.read())
+
+
+class CachedSpacyNLP(SpacyNLP):
+    # nlp_spacy reading the training docs from the cache when it can
+
+    def __init__(self, component_config=None, nlp=None, cache_dir=CACHE_DIR):
+        super(CachedSpacyNLP, self).__init__(component_config, nlp)
+        self.cache_dir = cache_dir
+
+    def _text(self, text):
+        return text if self.component_config.get("case_sensitive") else text.lower()
+
+    def train(self, training_data, config, **kwargs):
+        self.set_docs(training_data.training_examples)
+
+    def set_docs(self, examples):
+        # same spacy_doc as process on every example, the texts missing from
+        # the cache are analysed and added to it
+        path = os.path.join(self.cache_dir, digest(spacy_config(self)) + '.docs')
+        cached = {}
+        if os.path.exists(path):
+            frames = read_frames(path)
+            cached = dict(zip(frames[0::2], frames[1::2]))
+
+        keys = [digest(example.text).encode('ascii') for example in examples]
+        missing = {}
+        for key, example in zip(keys, examples):
+            if key not in cached and key not in missing:
+                missing[key] = example.text
+        docs = dict(zip(missing, self.nlp.pipe([self._text(text) for text in missing.values()])))
+        if docs:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            cached.update((key, doc.to_bytes()) for key, doc in docs.items())
+            frames = []
+            for key, value in cached.items():
+                frames += [key, value]
+            write_frames(path, frames)
+
+        for key, example in zip(keys, examples):
+            doc = docs.get(key)
+            if doc is None:
+                doc = Doc(self.nlp.vocab).from_bytes(cached[key])
+            example.set("spacy_doc", doc)
+
+
+def cached_pipeline(pipeline, cache_dir=CACHE_DIR):
+    # the pipeline with its nlp_spacy component reading the cache
+    return [CachedSpacyNLP(c.component_config, c.nlp, cache_dir) if type(c) is SpacyNLP else c
+            for c in pipeline]
+
+
+def use_cache(trainer, cache_dir=CACHE_DIR):
+    # the nlp_spacy component of a Trainer reads the cache while it trains, the
+    # stock one is back for persist so that the metadata.json of the model
+    # names rasa_nlu's SpacyNLP and loads without this module
+    train = trainer.train
+
+    def cached_train(data, **kwargs):
+        pipeline = trainer.pipeline
+        trainer.pipeline = cached_pipeline(pipeline, cache_dir)
+        try:
+            return train(data, **kwargs)
+        finally:
+            trainer.pipeline = pipeline
+
+    trainer.train = cached_train
+    return trainer
+
+
+MANIFEST_FILE_NAME = 'training_manifest.json'
+
+
+def training_manifest(data, configs):
+    # what a trained model depends on, training is skipped while it matches.
+    # scikit-learn is only imported here, the servers never need it
+    import sklearn
+
+    return {
+        "data": file_digest(data),
+        "config": file_digest(configs),
+        "resources": {path: file_digest(path) for path in RESOURCE_FILES if os.path.exists(path)},
+        "versions": {
+            "rasa_nlu": rasa_nlu.__version__,
+            "spacy": spacy.__version__,
+            "sklearn": sklearn.__version__,
+            "numpy": numpy.__version__,
+        },
+    }
+
+
+def read_manifest(model_directory):
+    path = os.path.join(model_directory, MANIFEST_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with io.open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(model_directory, manifest):
+    with io.open(os.path.join(model_directory, MANIFEST_FILE_NAME), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(manifest, indent=4, sort_keys=True))